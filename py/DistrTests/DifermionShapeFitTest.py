@@ -5,43 +5,38 @@ import os
 import sys
 
 sys.path.append("../PrEWInputAnalysis")
+import Distribution.Distribution as DD
 import FuncHelp.Wrappers as FHW
 import IO.FilenameHelp as IOFH
-import IO.Reader as IOR
 import IO.SysHelpers as IOSH
 import Plotting.DefaultFormat as PDF
 import Plotting.Naming as PN
+import Processing.ParallelRunner as PPR
 import Shape.ShapeFunctions as SSF
 import Shape.ShapeTesting as SST
+import Shape.ShapeToys as SSToy
 
-log.basicConfig(level=log.INFO) # Set logging level
-PDF.set_default_mpl_format()
 MCLumi = 5000 # MC Statistics is 5ab^-1
+n_toys = 1000 # Poisson toys per fit to calibrate the chi^2/ndf
 
-input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925"
-# input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925/TrueAngle"
-
-output_dir = input_dir + "/shape_checks"
-IOSH.create_dir(output_dir)
-
-log.info("Looking in dir: {}".format(input_dir))
-for file_path in IOSH.find_files(input_dir, ".csv"):
+def fit_and_plot(file_path, input_dir, output_dir):
+  """ Fit the shapes to the distribution in the given file and plot the results.
+      Returns the paths of the created files.
+  """
   # Read the input file
   base_name = os.path.basename(file_path).replace(".csv","")
   log.info("Reading file: {}.csv".format(base_name))
-  reader = IOR.Reader(file_path)
+  distr = DD.Distribution.from_file(file_path)
 
-  # Get the pandas dataframe for the cut histograms
+  # Get the cut histograms
   angle = "costh_f_star_true" if "TrueAngle" in input_dir else "costh_f_star"
-  df = reader["Data"]
-  bin_vals = np.array(df["Cross sections"])
-  bin_middles = np.array(df["BinCenters:{}".format(angle)])
-  edges_min = np.array(df["BinLow:{}".format(angle)])
-  edges_max = np.array(df["BinUp:{}".format(angle)])
+  bin_middles = distr.center(angle)
+  edges_min = distr.low(angle)
+  edges_max = distr.up(angle)
   bin_width = edges_max[0] - edges_min[0]
 
   # Rescale to MC Lumi
-  bin_vals *= MCLumi
+  bin_vals = MCLumi * distr.values
 
   # Perform fits to the distributions
   fit_vals_ha, p_ha, cov_ha = SST.fit_1D(SSF.helicity_amplitudes, bin_vals, edges_min, edges_max, bounds=[[0,0],[np.inf,np.inf]])
@@ -56,6 +51,23 @@ for file_path in IOSH.find_files(input_dir, ".csv"):
   chisq_ndf_ha = SST.chi_squared(bin_vals, fit_vals_ha) / (n_bins - 2)
   chisq_ndf_hac = SST.chi_squared(bin_vals, fit_vals_hac) / (n_bins - 3)
   
+  # Likelihood ratio goodness of fit of binned Poisson likelihood fits
+  fit_vals_ha_nll = SST.fit_1D(SSF.helicity_amplitudes, bin_vals, edges_min, edges_max, bounds=[[0,0],[np.inf,np.inf]], cost="poisson")[0]
+  fit_vals_hac_nll = SST.fit_1D(SSF.helicity_amplitudes_cor, bin_vals, edges_min, edges_max, bounds=[[0,0,-np.inf],[np.inf,np.inf,np.inf]], cost="poisson")[0]
+  log.info("Likelihood ratio / ndf (p-value):")
+  log.info("  Pure HA: {} ({})".format(*SST.likelihood_ratio_gof(bin_vals, fit_vals_ha_nll, 2)))
+  log.info("  w/ corr: {} ({})".format(*SST.likelihood_ratio_gof(bin_vals, fit_vals_hac_nll, 3)))
+  
+  # Compare to the chi-squared's of toys drawn from the fitted shapes
+  toys_ha = SSToy.toy_study(SSF.helicity_amplitudes, fit_vals_ha, edges_min, edges_max, n_toys=n_toys, seed=1, bounds=[[0,0],[np.inf,np.inf]])
+  toys_hac = SSToy.toy_study(SSF.helicity_amplitudes_cor, fit_vals_hac, edges_min, edges_max, n_toys=n_toys, seed=1, bounds=[[0,0,-np.inf],[np.inf,np.inf,np.inf]])
+  log.info("Toy p-value of chi^2/ndf:")
+  log.info("  Pure HA: {}".format(toys_ha.chisq_p_value(chisq_ndf_ha)))
+  log.info("  w/ corr: {}".format(toys_hac.chisq_p_value(chisq_ndf_hac)))
+  log.info("Toy pulls (mean, error, width, error):")
+  log.info("  Pure HA:\n{}".format(toys_ha.pull_summary()))
+  log.info("  w/ corr:\n{}".format(toys_hac.pull_summary()))
+  
   # Before plotting, scale back to cross section level
   bin_vals /= MCLumi / bin_width
   fit_vals_ha /= MCLumi / bin_width
@@ -89,7 +101,8 @@ for file_path in IOSH.find_files(input_dir, ".csv"):
 
   ax.legend( loc=0, ncol=2, title=r"$\chi^2_{pure}/ndf = $" + str(np.round_(chisq_ndf_ha, decimals=1)) + "\n$\chi^2_{cor}/ndf = $" + str(np.round_(chisq_ndf_hac, decimals=1)) )
 
-  fig.savefig("{}/{}_shape_check.pdf".format(output_dir, base_name))
+  out_paths = ["{}/{}_shape_check.pdf".format(output_dir, base_name)]
+  fig.savefig(out_paths[-1])
   
   plt.close(fig)
   
@@ -112,5 +125,34 @@ for file_path in IOSH.find_files(input_dir, ".csv"):
 
   ax.legend( loc=0, title=r"$\chi^2_{pure}/ndf = $" + str(np.round_(chisq_ndf_ha, decimals=1)) )
 
-  fig.savefig("{}/{}_shape_check_HelAmplOnly.pdf".format(output_dir, base_name))
+  out_paths.append("{}/{}_shape_check_HelAmplOnly.pdf".format(output_dir, base_name))
+  fig.savefig(out_paths[-1])
   plt.close(fig)
+  
+  return out_paths
+
+def main():
+  log.basicConfig(level=log.INFO) # Set logging level
+  PDF.set_default_mpl_format()
+  
+  input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925"
+  # input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925/TrueAngle"
+
+  output_dir = input_dir + "/shape_checks"
+  IOSH.create_dir(output_dir)
+
+  log.info("Looking in dir: {}".format(input_dir))
+  file_paths = IOSH.find_files(input_dir, ".csv")
+  
+  # Only refit changed inputs (or after changes of script or fit options)
+  manifest = IOSH.BuildManifest(output_dir + "/manifest.json")
+  config = {"script": IOSH.file_hash(__file__), "MCLumi": MCLumi, 
+            "n_toys": n_toys}
+  results, _ = PPR.run_over_files(
+    fit_and_plot, manifest.stale_targets(file_paths, config), input_dir, output_dir)
+  for file_path, out_paths in results.items():
+    manifest.record(file_path, [file_path], out_paths, config)
+  manifest.save()
+
+if __name__ == "__main__":
+  main()
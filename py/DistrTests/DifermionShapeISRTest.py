@@ -5,9 +5,9 @@ import os
 import sys
 
 sys.path.append("../PrEWInputAnalysis")
+import Distribution.Distribution as DD
 import FuncHelp.Wrappers as FHW
-import IO.FilenameHelp as IOFH
-import IO.Reader as IOR
+import IO.Catalogue as IOC
 import IO.SysHelpers as IOSH
 import Plotting.DefaultFormat as PDF
 import Plotting.Naming as PN
@@ -18,36 +18,49 @@ log.basicConfig(level=log.INFO) # Set logging level
 PDF.set_default_mpl_format()
 MCLumi = 5000 # MC Statistics is 5ab^-1
 
-input_dir_nocor = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925"
-input_dir_sicor = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925/TrueAngle"
+input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925"
 
-output_dir = input_dir_nocor + "/ISR_shape_checks"
+output_dir = input_dir + "/ISR_shape_checks"
 IOSH.create_dir(output_dir)
 
+# Catalogue of the input tree (incl. the TrueAngle subdirectory), the index is
+# kept with the outputs as the input tree may be read-only
+catalogue = IOC.Catalogue.scan(input_dir, 
+                               index_path=output_dir + "/catalogue.json")
+
+# Pair each return-to-Z muon file without correction with its true-angle 
+# version at the same energy
 file_pairs = [
-  ["2f_mu_81to101_BZ_250_eLpR.csv", "2f_mu_81to101_BZ_true_250_eLpR.csv"],
-  ["2f_mu_81to101_BZ_250_eRpL.csv", "2f_mu_81to101_BZ_true_250_eRpL.csv"],
-  ["2f_mu_81to101_FZ_250_eLpR.csv", "2f_mu_81to101_FZ_true_250_eLpR.csv"],
-  ["2f_mu_81to101_FZ_250_eRpL.csv", "2f_mu_81to101_FZ_true_250_eRpL.csv"],
-]
+  (entry, catalogue.partner(entry, ["process", "chirality", "Z_direction", 
+                                    "mass_label", "Energy"], true_angle=True))
+  for entry in catalogue.select(process="2f_mu", mass_label="return_to_Z", 
+                                true_angle=False, 
+                                Z_direction=lambda Z_dir: Z_dir is not None) ]
+
+# Only redo the pairs of which either file (or the script) changed, the target
+# of each pair is its file without correction
+manifest = IOSH.BuildManifest(output_dir + "/manifest.json")
+config = {"script": IOSH.file_hash(__file__), "MCLumi": MCLumi}
 
-for file_pair in file_pairs:
+for entry_nocor, entry_sicor in file_pairs:
+  inputs = [entry_nocor["path"], entry_sicor["path"]]
+  if not manifest.is_stale(entry_nocor["path"], inputs, config):
+    continue
+  
   # Read the input file
-  base_name = file_pair[0].replace(".csv","")
+  base_name = entry_nocor["file_name"].replace(".csv","")
   log.info("Processing: {}".format(base_name))
-  reader_nocor = IOR.Reader(input_dir_nocor + "/" + file_pair[0])
-  reader_sicor = IOR.Reader(input_dir_sicor + "/" + file_pair[1])
+  distr_nocor = DD.Distribution.from_file(entry_nocor["path"])
+  distr_sicor = DD.Distribution.from_file(entry_sicor["path"])
 
-  # Get the pandas dataframe for the cut histograms
-  df_nocor = reader_nocor["Data"]
-  df_sicor = reader_sicor["Data"]
-  bin_vals_nocor = MCLumi * np.array(df_nocor["Cross sections"])
-  bin_vals_sicor = MCLumi * np.array(df_sicor["Cross sections"])
+  # Get the cut histograms
+  bin_vals_nocor = MCLumi * distr_nocor.values
+  bin_vals_sicor = MCLumi * distr_sicor.values
   
   angle = "costh_f_star"
-  bin_middles = np.array(df_nocor["BinCenters:{}".format(angle)])
-  edges_min = np.array(df_nocor["BinLow:{}".format(angle)])
-  edges_max = np.array(df_nocor["BinUp:{}".format(angle)])
+  bin_middles = distr_nocor.center(angle)
+  edges_min = distr_nocor.low(angle)
+  edges_max = distr_nocor.up(angle)
   bin_width = edges_max[0] - edges_min[0]
 
   # Perform fits to the distributions
@@ -87,11 +100,10 @@ for file_pair in file_pairs:
   ax.set_ylim(0,0.98*ax.get_ylim()[1])
   
   # Mark which process it is
-  chirality = IOFH.find_chirality(base_name)
-  Z_direction = IOFH.find_Z_direction(base_name)
-  mass_label = IOFH.find_2f_mass_label(base_name)
   process_str = "${}$".format(PN.difermion_process_str(
-                               "mu", chirality, mass_label, Z_direction))
+                               "mu", entry_nocor["chirality"], 
+                               entry_nocor["mass_label"], 
+                               entry_nocor["Z_direction"]))
   ax.set_title(process_str)
 
   handles, _ = ax.get_legend_handles_labels()
@@ -102,6 +114,10 @@ for file_pair in file_pairs:
                     "\n$\chi^2_{w/\, cor.}\,/ndf = $" + \
                     str(np.round_(chisq_ndf_sicor, decimals=1)) )
 
-  fig.savefig("{}/{}_ISR_shape_check.pdf".format(output_dir, base_name))
+  out_path = "{}/{}_ISR_shape_check.pdf".format(output_dir, base_name)
+  fig.savefig(out_path)
   
   plt.close(fig)
+  manifest.record(entry_nocor["path"], inputs, [out_path], config)
+
+manifest.save()
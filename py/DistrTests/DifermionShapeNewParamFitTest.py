@@ -5,111 +5,136 @@ import os
 import sys
 
 sys.path.append("../PrEWInputAnalysis")
+import Distribution.Distribution as DD
 import FuncHelp.Wrappers as FHW
 import IO.FilenameHelp as IOFH
-import IO.Reader as IOR
+import IO.Prefetch as IOP
 import IO.SysHelpers as IOSH
 import Plotting.DefaultFormat as PDF
 import Plotting.Naming as PN
 import Shape.ShapeFunctions as SSF
+import Shape.ShapeProperties as SSP
 import Shape.ShapeTesting as SST
 
 
+def dif_param_LR_coefs(xs0, Ae, Af, ef, k0, dk):
+  """ Polynomial coefficients (in cos_th) of dif_param_LR.
+  """
+  pre = 3./8. * xs0 * (1.0 + Ae)/2.0
+  return [pre * (1. + (k0 + dk)/2.0), pre * (ef + 2.0 * Af), 
+          pre * (1.0 - 3.0 * (k0 + dk)/2.0)]
+
+def dif_param_RL_coefs(xs0, Ae, Af, ef, k0, dk):
+  """ Polynomial coefficients (in cos_th) of dif_param_RL.
+  """
+  pre = 3./8. * xs0 * (1.0 - Ae)/2.0
+  return [pre * (1. + (k0 - dk)/2.0), pre * (ef - 2.0 * Af), 
+          pre * (1.0 - 3.0 * (k0 - dk)/2.0)]
+
+def dif_param_LR_grad(cos_th, xs0, Ae, Af, ef, k0, dk):
+  """ Gradient of dif_param_LR w.r.t. its parameters.
+  """
+  pre = 3./8. * xs0 * (1.0 + Ae)/2.0
+  shape = (1. + (k0 + dk)/2.0) + (ef + 2.0 * Af) * cos_th + (1.0 - 3.0 * (k0 + dk)/2.0) * cos_th*cos_th
+  d_k = pre * (0.5 - 1.5 * cos_th*cos_th)
+  return [3./8. * (1.0 + Ae)/2.0 * shape, 3./8. * xs0 / 2.0 * shape, 
+          pre * 2.0 * cos_th, pre * cos_th, d_k, d_k]
+
+def dif_param_RL_grad(cos_th, xs0, Ae, Af, ef, k0, dk):
+  """ Gradient of dif_param_RL w.r.t. its parameters.
+  """
+  pre = 3./8. * xs0 * (1.0 - Ae)/2.0
+  shape = (1. + (k0 - dk)/2.0) + (ef - 2.0 * Af) * cos_th + (1.0 - 3.0 * (k0 - dk)/2.0) * cos_th*cos_th
+  d_k = pre * (0.5 - 1.5 * cos_th*cos_th)
+  return [3./8. * (1.0 - Ae)/2.0 * shape, -3./8. * xs0 / 2.0 * shape, 
+          -pre * 2.0 * cos_th, pre * cos_th, d_k, -d_k]
+
+@SSP.polynomial(dif_param_LR_coefs)
+@SSP.gradient(dif_param_LR_grad)
 def dif_param_LR(cos_th, xs0, Ae, Af, ef, k0, dk):
   """ Difermion parametrisation in the difermion rest frame for the left-handed
       electron right-handed positron initial state.
   """
   return 3./8. * xs0 * (1.0 + Ae)/2.0 * ( (1. + (k0 + dk)/2.0) + (ef + 2.0 * Af) * cos_th + (1.0 - 3.0 * (k0 + dk)/2.0) * cos_th*cos_th )
 
+@SSP.polynomial(dif_param_RL_coefs)
+@SSP.gradient(dif_param_RL_grad)
 def dif_param_RL(cos_th, xs0, Ae, Af, ef, k0, dk):
   """ Difermion parametrisation in the difermion rest frame for the right-handed
       electron left-handed positron initial state.
   """
   return 3./8. * xs0 * (1.0 - Ae)/2.0 * ( (1. + (k0 - dk)/2.0) + (ef - 2.0 * Af) * cos_th + (1.0 - 3.0 * (k0 - dk)/2.0) * cos_th*cos_th )
-  
-def dif_param_comb(cos_th, xs0, Ae, Af, ef, k0, dk):
-  """ Combine the two chiral ones with a trick:
-      RL cos_th values are shifted by +3 
-        => Recognize RL by x>1
-  """
-  if cos_th>1:
-    # Here need to substract the three again!
-    return dif_param_RL(cos_th-3, xs0, Ae, Af, ef, k0, dk)
-  else:
-    return dif_param_LR(cos_th, xs0, Ae, Af, ef, k0, dk)
-
-
-log.basicConfig(level=log.INFO) # Set logging level
-PDF.set_default_mpl_format()
-MCLumi = 5000 # MC Statistics is 5ab^-1
-
-input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925"
-
-output_dir = input_dir + "/shape_checks"
-IOSH.create_dir(output_dir)
 
-LR_RL_pairs = [
-  ["2f_mu_81to101_BZ_250_eLpR.csv","2f_mu_81to101_BZ_250_eRpL.csv"],
-  ["2f_mu_81to101_FZ_250_eLpR.csv","2f_mu_81to101_FZ_250_eRpL.csv"],
-  ["2f_mu_180to275_250_eLpR.csv","2f_mu_180to275_250_eRpL.csv"] ]
 
-for LR_file, RL_file in LR_RL_pairs:
-  LR_file_path = input_dir + "/" + LR_file
-  RL_file_path = input_dir + "/" + RL_file
-  
-  log.info("LR file: {}.csv".format(LR_file))
-  log.info("RL file: {}.csv".format(RL_file))
+def afb(p):
+  """ Forward-backward asymmetry from the parameters xs0, Ae, Af, ef, k0, dk.
+  """
+  xs0, Ae, Af, ef, k0, dk = p
+  return 3/8 * (ef + 2*Ae*Af)
 
-  # Read the input files
-  LR_reader = IOR.Reader(LR_file_path)
-  RL_reader = IOR.Reader(RL_file_path)
+def read_pair(input_dir, LR_RL_pair, columns):
+  """ Read the LR and RL distribution of the file pair.
+  """
+  return [DD.Distribution.from_file(input_dir + "/" + file_name, columns=columns)
+          for file_name in LR_RL_pair]
 
-  # Get the pandas dataframe for the cut histograms
-  angle = "costh_f_star"
+def main():
+  log.basicConfig(level=log.INFO) # Set logging level
+  PDF.set_default_mpl_format()
+  MCLumi = 5000 # MC Statistics is 5ab^-1
+  n_bootstrap = 1000 # Replicas for the A_FB uncertainty
   
-  LR_df = LR_reader["Data"]
-  LR_bin_vals = np.array(LR_df["Cross sections"])
-  LR_bin_middles = np.array(LR_df["BinCenters:{}".format(angle)])
-  LR_edges_min = np.array(LR_df["BinLow:{}".format(angle)])
-  LR_edges_max = np.array(LR_df["BinUp:{}".format(angle)])
-  LR_bin_vals *= MCLumi
+  input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/2f_Z_l/PrEWInput/MuAcc_costheta_0.9925"
   
-  RL_df = RL_reader["Data"]
-  RL_bin_vals = np.array(RL_df["Cross sections"])
-  RL_bin_middles = np.array(RL_df["BinCenters:{}".format(angle)])
-  RL_edges_min = np.array(RL_df["BinLow:{}".format(angle)])
-  RL_edges_max = np.array(RL_df["BinUp:{}".format(angle)])
-  RL_bin_vals *= MCLumi
+  output_dir = input_dir + "/shape_checks"
+  IOSH.create_dir(output_dir)
   
-  # Shift RL cos_th values for common function trick
-  RL_bin_vals += 3
-  RL_bin_middles += 3
-  RL_edges_min += 3
-  RL_edges_max += 3
+  LR_RL_pairs = [
+    ["2f_mu_81to101_BZ_250_eLpR.csv","2f_mu_81to101_BZ_250_eRpL.csv"],
+    ["2f_mu_81to101_FZ_250_eLpR.csv","2f_mu_81to101_FZ_250_eRpL.csv"],
+    ["2f_mu_180to275_250_eLpR.csv","2f_mu_180to275_250_eRpL.csv"] ]
   
-  comb_edges_min = np.concatenate((LR_edges_min,RL_edges_min))
-  comb_edges_max = np.concatenate((LR_edges_max,RL_edges_max))
-  comb_bin_vals = np.concatenate((LR_bin_vals,RL_bin_vals))
-
-  # Perform fits to the distributions
-  fit_vals, p, cov = SST.fit_1D(dif_param_comb, comb_bin_vals, comb_edges_min, comb_edges_max, bounds=[[0,-np.inf,-np.inf,-np.inf,-np.inf,-np.inf],[np.inf,np.inf,np.inf,np.inf,np.inf,np.inf]])
-  
-  log.info("Parameters:\n{}".format(p))
-  log.info("Uncertainties:\n{}".format(np.sqrt(cov.diagonal())))
+  # Read the input files (only the needed columns)
+  angle = "costh_f_star"
+  columns = ["Cross sections", "BinLow:{}".format(angle), "BinUp:{}".format(angle)]
   
-  # Parameters: xs0, Ae, Af, ef, k0, dk
-  i_Ae = 1
-  i_Af = 2
-  i_ef = 3
-  Ae = p[i_Ae]
-  Af = p[i_Af]
-  ef = p[i_ef]
-  AFB = 3/8 * (ef + 2*Ae*Af)
-  d_AFB = 3/8 * np.sqrt( \
-    cov[i_ef][i_ef] + (2*Ae)**2 * cov[i_Af][i_Af] + (2*Af)**2 * cov[i_Ae][i_Ae] + \
-    4 * Ae * cov[i_ef][i_Af] + 4 * Af * cov[i_ef][i_Ae] + 8 * Ae * Af * cov[i_Ae][i_Af]
-    )
+  # Next pairs are read in the background while the current one is fitted
+  loader = IOP.PrefetchLoader(
+    LR_RL_pairs, load=lambda pair: read_pair(input_dir, pair, columns))
+  for (LR_file, RL_file), (LR_distr, RL_distr) in loader:
+    log.info("LR file: {}.csv".format(LR_file))
+    log.info("RL file: {}.csv".format(RL_file))
     
-  log.info("AFB: {} \pm {}".format(AFB,d_AFB))
-  
-  log.info("\n")
\ No newline at end of file
+    # Get the cut histograms
+    LR_bin_vals = MCLumi * LR_distr.values
+    LR_edges_min = LR_distr.low(angle)
+    LR_edges_max = LR_distr.up(angle)
+    
+    RL_bin_vals = MCLumi * RL_distr.values
+    RL_edges_min = RL_distr.low(angle)
+    RL_edges_max = RL_distr.up(angle)
+    
+    # Fit both chiralities simultaneously with shared parameters
+    channels = [
+      SST.FitChannel("LR", dif_param_LR, LR_bin_vals, LR_edges_min, LR_edges_max),
+      SST.FitChannel("RL", dif_param_RL, RL_bin_vals, RL_edges_min, RL_edges_max) ]
+    bounds = [[0,-np.inf,-np.inf,-np.inf,-np.inf,-np.inf],[np.inf,np.inf,np.inf,np.inf,np.inf,np.inf]]
+    fit_vals, p, cov = SST.fit_simultaneous(channels, bounds=bounds)
+    
+    log.info("Parameters:\n{}".format(p))
+    log.info("Uncertainties:\n{}".format(np.sqrt(cov.diagonal())))
+    
+    # A_FB and its uncertainty from refitting Poisson replicas of the inputs
+    # (replica fits start at the nominal result)
+    fit_config = SST.SimultaneousFitConfig(channels, bounds=bounds, p0=p)
+    AFB_boot = SST.bootstrap(fit_config, afb, fit_config.bin_vals(), 
+                             n_replicas=n_bootstrap, seed=1)
+    AFB = AFB_boot.nominal[0]
+    AFB_low, AFB_up = [bound[0] for bound in AFB_boot.interval()]
+      
+    log.info("AFB: {} + {} - {}".format(AFB, AFB_up - AFB, AFB - AFB_low))
+    
+    log.info("\n")
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
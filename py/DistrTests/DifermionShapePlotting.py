@@ -1,53 +1,33 @@
 import logging as log
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
-from tqdm import tqdm
 
 sys.path.append("../PrEWInputAnalysis")
+import Distribution.Distribution as DD
 import IO.FilenameHelp as IOFH
-import IO.Reader as IOR
 import IO.SysHelpers as IOSH
 import Plotting.DefaultFormat as PDF
 import Plotting.Naming as PN
+import Plotting.Rendering as PR
+import Plotting.Templates as PT
+import Processing.ParallelRunner as PPR
 
 def plot_mumu_distr(infile, outdir, out_formats=["pdf","png"]):
   """ Plot the distribution that is stored in the given file.
+      Returns the paths of the created files.
   """
   base_name = os.path.basename(infile).replace(".csv","")
   
   log.debug("Reading file: {}.csv".format(base_name))
-  reader = IOR.Reader(infile)
+  distr = DD.Distribution.from_file(infile)
   
-  # Get the pandas dataframe for the cut histograms
-  df = reader["Data"]
-  
-  # Get the data
+  # Get the data on the exact binning
   x_name = "costh_f_star"
-  x = np.array(df["BinCenters:{}".format(x_name)])
-  y = np.array(df["Cross sections"])
-  
-  xmin = np.array(np.amin(df["BinLow:{}".format(x_name)]))
-  xmax = np.array(np.amax(df["BinUp:{}".format(x_name)]))
-  
-  # Bin counting assumes that bins are not binned thinner than 1/1000 and that
-  # absolute values are of order 0.1-1
-  nbins = len( np.unique((x*10000.).astype(int)) )
-  
-  # Create the figure and plot
-  fig = plt.figure(figsize=(6.5, 5), tight_layout=True)
-  ax = plt.gca()
-  ax.hist( x=x, weights=y, bins=nbins, range=(xmin, xmax),
-           ls="-", lw=3, histtype=u'step' )
-    
-  # Useful limits
-  ax.set_xlim(xmin, xmax)
-  # ax.set_ylim(0, 1.1*ax.get_ylim()[1])
-  
-  # Useful labels
-  ax.set_xlabel("${}$".format(PN.observable_str(x_name, "mumu")))
-  ax.set_ylabel("$d\\sigma [$fb$]$")
+  axis_binning = distr.binning().axis(x_name)
+  edges = axis_binning.edges
+  y = np.bincount(axis_binning.indices, weights=distr.values, 
+                  minlength=axis_binning.n_bins())
   
   # Mark which process it is
   chirality = IOFH.find_chirality(base_name)
@@ -55,16 +35,25 @@ def plot_mumu_distr(infile, outdir, out_formats=["pdf","png"]):
   mass_label = IOFH.find_2f_mass_label(base_name)
   process_str = "${}$".format(PN.difermion_process_str(
                                "mu", chirality, mass_label, Z_direction))
-  ax.set_title(process_str)
+  
+  # Draw into the figure template (layout only built once per process)
+  template = PT.get_template(x_name, lambda: PT.StepTemplate(
+    "${}$".format(PN.observable_str(x_name, "mumu")), "$d\\sigma [$fb$]$", 
+    ls="-", lw=3))
+  template.update(y, edges, process_str)
   
   # Save the plot in files
+  out_paths = []
   for out_format in out_formats:
     format_dir = "{}/{}".format(outdir,out_format)
     IOSH.create_dir(format_dir)
-    fig.savefig("{}/{}_{}.{}".format(format_dir,base_name,x_name,out_format), 
-                transparent=True, bbox_inches='tight')
+    out_paths.append("{}/{}_{}.{}".format(format_dir,base_name,x_name,out_format))
+  template.save(out_paths)
+  return out_paths
                 
-def main():
+def main(bundle_pdf=False):
+  """ bundle_pdf ... Also put all plots into one multi-page PDF
+  """
   log.basicConfig(level=log.INFO) # Set logging level
   PDF.set_default_mpl_format()
   input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction"+\
@@ -72,10 +61,28 @@ def main():
   output_dir = input_dir + "/shape_checks/2fShapePlots"
   
   log.info("Looking in dir: {}".format(input_dir))
-  for file_path in tqdm(IOSH.find_files(input_dir, ".csv"), desc="files"):
-    if not "2f_mu" in file_path:
-      continue # Only draw mumu distributions
-    plot_mumu_distr(file_path, output_dir)
+  # Only draw mumu distributions
+  file_paths = [file_path for file_path in IOSH.find_files(input_dir, ".csv") 
+                if "2f_mu" in file_path]
+  
+  # Only redraw the plots of changed inputs (or after script changes)
+  manifest = IOSH.BuildManifest(output_dir + "/manifest.json")
+  config = {"script": IOSH.file_hash(__file__)}
+  n_workers = None
+  if bundle_pdf:
+    # All plots of the run (also unchanged ones) are drawn in this process and
+    # collected as pages of one PDF
+    IOSH.create_dir(output_dir)
+    PR.configure(multipage_path="{}/2fShapePlots.pdf".format(output_dir))
+    n_workers = 1
+  else:
+    file_paths = manifest.stale_targets(file_paths, config)
+  results, _ = PPR.run_over_files(plot_mumu_distr, file_paths, output_dir, 
+                                  n_workers=n_workers)
+  PT.release_templates() # Finishes writing the plots
+  for file_path, out_paths in results.items():
+    manifest.record(file_path, [file_path], out_paths, config)
+  manifest.save()
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -1,176 +1,200 @@
+import json
 import logging as log
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
-from tqdm import tqdm
 
 sys.path.append("../PrEWInputAnalysis")
+import Distribution.Distribution as DD
 import FuncHelp.Wrappers as FHW
+import IO.ColumnStore as IOCS
 import IO.FilenameHelp as IOFH
 import IO.Reader as IOR
 import IO.SysHelpers as IOSH
 import Plotting.DefaultFormat as PDF
 import Plotting.Naming as PN
+import Plotting.Rendering as PR
+import Plotting.Templates as PT
+import Processing.ParallelRunner as PPR
+import Shape.ShapeFunctions as SSF
+import Shape.ShapeTesting as SST
 
-def add_hist2d(ax, x, y, nbins, xmin, xmax, i, j, **kwargs):
-  """ Add the hist2d to the ax for the angles of indices i and j.
-  """
-  return ax.hist2d(
-    x=x[i], y=x[j], weights=y,
-    bins=(nbins[i], nbins[j]), range=[(xmin[i], xmax[i]),(xmin[j], xmax[j])],
-    **kwargs)
+MCLumi = 5000 # MC Statistics is 5ab^-1
+max_order_W = 4 # Order of the Legendre series in cos(theta_W) of the 3D fit
 
-def create_2D_projection_plot(x, y, xmin, xmax, nbins, angles, base_name, 
-                              outdir, out_formats):
-  """ Create a plot showing the 3 different 2D projections of the 3D 
-      distribution.
+def output_paths(outdir, out_formats, file_name):
+  """ Paths of the output file in each of the formats (one directory each).
   """
-  # Figure basics
-  fig, axs = plt.subplots(2, 3, sharex='col', sharey='row', figsize=(12,9),
-                          tight_layout=True,
-                          gridspec_kw={'hspace': 0.0, 'wspace': 0.0})
-  (ax1, ax_empty, _1), (ax2, ax3, _2) = axs
-  _1.axis('off')
-  _2.axis('off')
-  ax_empty.axis('off')
-
-  # Draw ticks only on the relevant axes
-  ax1.tick_params(bottom=False, top=True, left=True, right=True, 
-                  labelleft=False, labeltop=True, labelright=True)
-  ax2.tick_params(labelbottom=False, labelleft=False)
-  ax3.tick_params(bottom=True, top=True, left=False, right=True, 
-                  labeltop=True, labelright=True, labelbottom=False)
-
-  # Actually plot the histograms
-  h1 = add_hist2d(ax1, x, y, nbins, xmin, xmax, 0, 1)
-  h2 = add_hist2d(ax2, x, y, nbins, xmin, xmax, 0, 2)
-  h3 = add_hist2d(ax3, x, y, nbins, xmin, xmax, 1, 2)
-
-  # Set a useful common color scale on all histograms
-  cmax = np.amax([ np.amax(y_h) for y_h in (h1[0], h2[0], h3[0]) ])
-  for h in [h1,h2,h3]:
-    h[-1].set_clim(0, cmax)
-
-  # Set useful axis limits
-  ax1.set_xlim((xmin[0],xmax[0]))
-  ax1.set_ylim((xmin[1],xmax[1]))
-  ax3.set_xlim((xmin[1],xmax[1]))
-  ax3.set_ylim((xmin[2],xmax[2]))
-
-  # Create small white lines between the plots
-  for ax_line in (ax2.spines['top'],ax2.spines['right'],ax1.spines['bottom'],
-                  ax3.spines['left']):
-    ax_line.set_linewidth(3)
-    ax_line.set_color('white')
-
-  # Proper labelling of the axes
-  label_args = {"fontsize":30, "ha":'center'}
-  ax1.text(0.5, 1.2, "${}$".format(PN.observable_str(angles[0], "WW")), transform=ax1.transAxes, **label_args)
-  ax_empty.text(0.5, 0.5, "${}$".format(PN.observable_str(angles[1], "WW")), transform=ax_empty.transAxes, **label_args)
-  ax3.text(1.12, 0.65, "${}$".format(PN.observable_str(angles[2], "WW")), transform=ax3.transAxes, **label_args)
-
-  # Add a colorbar
-  # cbar_title = "$\\frac{d^2\\sigma}{dx_1dx_2} [$fb$^{{-1}}]$"
-  cbar_title = "$d\\sigma [$fb$]$"
-  ax_whole = fig.add_subplot(1,6,5, visible=False)
-  fig.colorbar(h1[-1], ax=ax_whole, label=cbar_title, fraction=1.0)
-  # ax_whole.text(0.5, 0.65, "$d\\sigma [$fb$^{{-1}}]$", 
-  #               transform=ax_whole.transAxes, **label_args)
+  out_paths = []
+  for out_format in out_formats:
+    format_dir = "{}/{}".format(outdir,out_format)
+    IOSH.create_dir(format_dir)
+    out_paths.append("{}/{}.{}".format(format_dir,file_name,out_format))
+  return out_paths
 
-  # Mark which process it is
+def process_str(base_name):
+  """ Label of the process of the file.
+  """
   chirality = IOFH.find_chirality(base_name)
   mu_charge = IOFH.find_lep_charge(base_name, "mu")
-  process_str="${}$".format(PN.WW_process_str(chirality, mu_charge))
-  ax_empty.text(0.5, 1.2, process_str, transform=ax_empty.transAxes, 
-        bbox=dict(facecolor='none', edgecolor='black', boxstyle='round'), 
-        **label_args)
+  return "${}$".format(PN.WW_process_str(chirality, mu_charge))
 
+def create_2D_projection_plot(projections, edges, angles, base_name, outdir, 
+                              out_formats):
+  """ Create a plot showing the 3 different 2D projections of the 3D 
+      distribution.
+      The figure layout is only built for the first file (per process).
+  """
+  template = PT.get_template(("WW_2D", angles), lambda: PT.Projection2DTemplate(
+    ["${}$".format(PN.observable_str(angle, "WW")) for angle in angles],
+    "$d\\sigma [$fb$]$"))
+  template.update(projections, edges, process_str(base_name))
+  
   # Save the plot in files
-  for out_format in out_formats:
-    format_dir = "{}/{}".format(outdir,out_format)
-    IOSH.create_dir(format_dir)
-    fig.savefig("{}/{}.{}".format(format_dir,base_name,out_format), 
-                transparent=True, bbox_inches='tight')
-  plt.close(fig)
+  out_paths = output_paths(outdir, out_formats, base_name)
+  template.save(out_paths)
+  return out_paths
   
-def create_1D_projection_plot(i_coord, x, y, xmin, xmax, nbins, angles, 
-                              base_name, outdir, out_formats):
+def create_1D_projection_plot(i_coord, projections, edges, angles, base_name, 
+                              outdir, out_formats):
   """ Create a 1D projection plot for the given coordinate.
+      The figure layout is only built for the first file (per process).
   """
-  
-  # Create the figure and plot
-  fig = plt.figure(figsize=(6.5, 5), tight_layout=True)
-  ax = plt.gca()
-  ax.hist(
-    x=x[i_coord], weights=y,
-    bins=nbins[i_coord], range=(xmin[i_coord], xmax[i_coord]),
-    ls="-", lw=3, histtype=u'step')
-    
-  # Useful limits
-  ax.set_xlim(xmin[i_coord], xmax[i_coord])
-  ax.set_ylim(0, 1.1*ax.get_ylim()[1])
-  
-  # Useful labels
   angle = angles[i_coord]
-  ax.set_xlabel("${}$".format(PN.observable_str(angle, "WW")))
-  ax.set_ylabel("$d\\sigma [$fb$]$")
-  
-  # Mark which process it is
-  chirality = IOFH.find_chirality(base_name)
-  mu_charge = IOFH.find_lep_charge(base_name, "mu")
-  process_str="${}$".format(PN.WW_process_str(chirality, mu_charge))
-  ax.set_title(process_str)
+  template = PT.get_template(("WW_1D", angle), lambda: PT.StepTemplate(
+    "${}$".format(PN.observable_str(angle, "WW")), "$d\\sigma [$fb$]$", 
+    ymax_scale=1.1, ls="-", lw=3))
+  template.update(projections[(i_coord,)], edges[i_coord], process_str(base_name))
   
   # Save the plot in files
-  for out_format in out_formats:
-    format_dir = "{}/{}".format(outdir,out_format)
-    IOSH.create_dir(format_dir)
-    fig.savefig("{}/{}_{}.{}".format(format_dir,base_name,angle,out_format), 
-                transparent=True, bbox_inches='tight')
+  out_paths = output_paths(outdir, out_formats, "{}_{}".format(base_name,angle))
+  template.save(out_paths)
+  return out_paths
 
-def plot_WW_distr(infile, outdir, out_formats=["pdf","png"]):
-  """ Plot the distribution that is stored in the given file.
+def read_WW_distr(infile):
+  """ Read the distribution from the given file (CSV file or column store 
+      directory).
+  """
+  log.debug("Reading: {}".format(infile))
+  if os.path.isdir(infile):
+    reader = IOCS.ColumnStore(infile) # Memory mapped
+  else:
+    reader = IOR.Reader(infile)
+  return DD.Distribution.from_reader(reader)
+
+def fit_WW_distr(infile, outdir):
+  """ Fit the full 3D distribution in the given file with the separable WW 
+      angular shape using the binned Poisson likelihood (3D bins can be 
+      sparsely populated).
+      The parameters, their covariance and the likelihood ratio goodness of 
+      fit are written to a JSON file.
+      Returns the path of the created file.
   """
   base_name = os.path.basename(infile).replace(".csv","")
+  distr = read_WW_distr(infile)
+  
+  angles = ("costh_Wminus_star", "costh_l_star", "phi_l_star")
+  lower = np.column_stack([distr.low(angle) for angle in angles])
+  upper = np.column_stack([distr.up(angle) for angle in angles])
+  bin_vals = MCLumi * distr.values # Rescale to MC Lumi
   
-  log.debug("Reading file: {}.csv".format(base_name))
-  reader = IOR.Reader(infile)
+  shape = SSF.WW_angular_shape(max_order_W)
+  fit_vals, p, cov = SST.fit_ND(shape, bin_vals, lower, upper, cost="poisson")
+  lr_ndf, p_value = SST.likelihood_ratio_gof(bin_vals, fit_vals, len(p))
+  log.info("3D fit of {} ({} bins, {} parameters): "
+           "likelihood ratio / ndf {} (p-value {})".format(
+           base_name, len(bin_vals), len(p), lr_ndf, p_value))
   
-  # Get the pandas dataframe for the cut histograms
-  df = reader["Data"]
+  IOSH.create_dir(outdir)
+  out_path = "{}/{}_fit.json".format(outdir, base_name)
+  with open(out_path, 'w') as write_obj:
+    json.dump({"angles": angles, "max_order_W": max_order_W, 
+               "n_bins": len(bin_vals), "parameters": p.tolist(), 
+               "covariance": cov.tolist(), "likelihood_ratio_ndf": lr_ndf, 
+               "p_value": p_value}, write_obj, indent=1)
+  return [out_path]
   
-  # Get the data
-  angles = ("costh_Wminus_star", "costh_l_star", "phi_l_star")
-  x = np.array([df["BinCenters:{}".format(angle)] for angle in angles])
-  y = np.array(df["Cross sections"])
+def plot_WW_distr(infile, outdir, out_formats=["pdf","png"]):
+  """ Plot the distribution that is stored in the given file (CSV file or 
+      column store directory).
+      Returns the paths of the created files.
+  """
+  base_name = os.path.basename(infile).replace(".csv","")
+  distr = read_WW_distr(infile)
   
-  xmin = np.array([np.amin(df["BinLow:{}".format(angle)]) for angle in angles])
-  xmax = np.array([np.amax(df["BinUp:{}".format(angle)]) for angle in angles])
+  # All 1D and 2D projections, computed once from the dense 3D array and 
+  # indexed by the position of the angles in the list below
+  angles = ("costh_Wminus_star", "costh_l_star", "phi_l_star")
+  distr.projections()
+  projections = { 
+    axes: distr.projection(*[angles[i] for i in axes]) 
+    for axes in [(0,), (1,), (2,), (0,1), (0,2), (1,2)] }
   
-  # Bin counting assumes that bins are not binned thinner than 1/1000 and that
-  # absolute values are of order 0.1-1
-  nbins = np.array([
-    len( np.unique((x[d]*10000.).astype(int)) ) for d in range(len(x)) ])
+  # Exact (possibly non-uniform) binning from the bin edges
+  binning = distr.binning()
+  edges = [binning.edges(angle) for angle in angles]
   
-  create_2D_projection_plot(
-    x, y, xmin, xmax, nbins, angles, base_name, outdir, out_formats)
+  out_paths = create_2D_projection_plot(
+    projections, edges, angles, base_name, outdir, out_formats)
   
   for i in range(len(angles)):
-    create_1D_projection_plot(i, x, y, xmin, xmax, nbins, angles, base_name, 
-                              outdir, out_formats)
+    out_paths += create_1D_projection_plot(
+      i, projections, edges, angles, base_name, outdir, out_formats)
   
-def main():
+  return out_paths
+  
+def main(bundle_pdf=False):
+  """ bundle_pdf ... Also put all plots into one multi-page PDF
+  """
   log.basicConfig(level=log.INFO) # Set logging level
   PDF.set_default_mpl_format()
   input_dir = "/home/jakob/DESY/MountPoints/DUST/TGCAnalysis/SampleProduction/NewMCProduction/4f_WW_sl/PrEWInput"
   output_dir = input_dir + "/shape_checks/WWShapePlots"
   
   log.info("Looking in dir: {}".format(input_dir))
-  for file_path in tqdm(IOSH.find_files(input_dir, ".csv"), desc="files"):
-    if "tau" in file_path:
-      continue # Skipping tau distributions, not use right now
-    plot_WW_distr(file_path, output_dir)
+  # Skipping tau distributions, not use right now
+  file_paths = [file_path for file_path in IOSH.find_files(input_dir, ".csv") 
+                if not "tau" in file_path]
+  
+  # Only redraw the plots and redo the 3D fits of changed inputs (or after 
+  # script changes), the fits are tracked separately from the plots
+  manifest = IOSH.BuildManifest(output_dir + "/manifest.json")
+  config = {"script": IOSH.file_hash(__file__), "MCLumi": MCLumi}
+  fit_manifest = IOSH.BuildManifest(output_dir + "/fit_manifest.json")
+  fit_config = dict(config, max_order_W=max_order_W)
+  n_workers = None
+  plot_paths = file_paths
+  if bundle_pdf:
+    # All plots of the run (also unchanged ones) are drawn in this process and
+    # collected as pages of one PDF
+    IOSH.create_dir(output_dir)
+    PR.configure(multipage_path="{}/WWShapePlots.pdf".format(output_dir))
+    n_workers = 1
+  else:
+    plot_paths = manifest.stale_targets(file_paths, config)
+  fit_paths = fit_manifest.stale_targets(file_paths, fit_config)
+  
+  # Plot and fit from memory-mapped column stores of the inputs, which are 
+  # converted only when missing or older than their CSV file
+  stores, _ = PPR.run_over_files(IOCS.update, 
+                                 sorted(set(plot_paths + fit_paths)), 
+                                 output_dir + "/column_stores", 
+                                 n_workers=n_workers, desc="stores")
+  results, _ = PPR.run_over_files(
+    plot_WW_distr, [stores[path] for path in plot_paths if path in stores], 
+    output_dir, n_workers=n_workers)
+  PT.release_templates() # Finishes writing the plots
+  fit_results, _ = PPR.run_over_files(
+    fit_WW_distr, [stores[path] for path in fit_paths if path in stores], 
+    output_dir + "/fits", n_workers=n_workers, desc="fits")
+  
+  for file_path, store in stores.items():
+    if store in results:
+      manifest.record(file_path, [file_path], results[store], config)
+    if store in fit_results:
+      fit_manifest.record(file_path, [file_path], fit_results[store], fit_config)
+  manifest.save()
+  fit_manifest.save()
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
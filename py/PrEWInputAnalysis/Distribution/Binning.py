@@ -0,0 +1,110 @@
+# ------------------------------------------------------------------------------
+
+""" Exact reconstruction of the binning of a distribution from the lower and
+    upper bin edges of its rows.
+"""
+
+# ------------------------------------------------------------------------------
+
+import numpy as np
+
+# ------------------------------------------------------------------------------
+
+def merge_edges(edges, rtol=1e-9):
+  """ Sorted distinct edges, where edges closer than rtol (relative to the
+      full range) are considered equal.
+  """
+  edges = np.unique(edges)
+  atol = rtol * max(edges[-1] - edges[0], np.finfo(float).tiny)
+  return edges[np.concatenate(([True], np.diff(edges) > atol))]
+
+def bin_indices(edges, lower, upper):
+  """ Index of the bin (of the given edge array) that contains each row.
+  """
+  # Bin middles are robust against rounding of the edges
+  return np.searchsorted(edges, 0.5 * (lower + upper), side='right') - 1
+
+# ------------------------------------------------------------------------------
+
+class AxisBinning:
+  """ Class describing the binning along one axis: the edge array (which may be
+      non-uniform) and the bin index of each row.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, lower, upper, rtol=1e-9):
+    """ lower, upper ... Lower and upper edges of each row on this axis
+    """
+    self.edges = merge_edges(np.concatenate((lower, upper)), rtol)
+    self.indices = bin_indices(self.edges, lower, upper)
+
+  # --- Access functions -------------------------------------------------------
+
+  def n_bins(self):
+    """ Number of bins on this axis.
+    """
+    return len(self.edges) - 1
+
+  def widths(self):
+    """ Width of each bin.
+    """
+    return np.diff(self.edges)
+
+  def centers(self):
+    """ Center of each bin.
+    """
+    return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+  def range(self):
+    """ Lowest and highest edge.
+    """
+    return self.edges[0], self.edges[-1]
+
+# ------------------------------------------------------------------------------
+
+class Binning:
+  """ Class describing the (multi-dimensional) binning of a distribution with
+      the integer multi-index of each row.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, lower, upper, axes, rtol=1e-9):
+    """ lower, upper ... Lower and upper edges (n_axes x n_rows)
+        axes ... Names of the axes
+    """
+    self.axes = tuple(axes)
+    self.axis_binnings = [AxisBinning(low, up, rtol)
+                          for low, up in zip(lower, upper)]
+    self.shape = tuple(axis.n_bins() for axis in self.axis_binnings)
+    self.indices = np.array([axis.indices for axis in self.axis_binnings])
+    self.flat_indices = np.ravel_multi_index(self.indices, self.shape)
+
+  # --- Access functions -------------------------------------------------------
+
+  def axis(self, axis):
+    """ Binning of the axis given by name (or index).
+    """
+    if not isinstance(axis, (int, np.integer)):
+      axis = self.axes.index(axis)
+    return self.axis_binnings[axis]
+
+  def edges(self, axis):
+    """ Edge array of the given axis.
+    """
+    return self.axis(axis).edges
+
+  def n_bins(self):
+    """ Total number of bins of the full binning.
+    """
+    return int(np.prod(self.shape))
+
+  def is_complete(self):
+    """ Check whether each bin of the full binning appears exactly once in the
+        rows.
+    """
+    return len(self.flat_indices) == self.n_bins() and \
+           np.all(np.bincount(self.flat_indices, minlength=self.n_bins()) == 1)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,185 @@
+# ------------------------------------------------------------------------------
+
+""" Compact representation of a (multi-dimensional) binned distribution.
+"""
+
+# ------------------------------------------------------------------------------
+
+import itertools
+import numpy as np
+
+# Local modules
+import Distribution.Binning as DB
+import Distribution.Projections as DP
+import IO.Reader as IOR
+
+# ------------------------------------------------------------------------------
+
+def read_only_array(values):
+  """ Contiguous, read-only float64 array of the given values.
+      A read-only view is returned for suitable arrays, so that the array of 
+      the caller stays writeable.
+  """
+  array = np.ascontiguousarray(values, dtype=np.float64).view()
+  array.flags.writeable = False
+  return array
+
+def read_only_columns(columns, n_axes):
+  """ Tuple with a read-only array for each axis, given either as sequence of
+      per-axis columns or as (n_axes x n_rows) array.
+      Suitable columns (e.g. memory mapped ones) are kept as views, not copied.
+  """
+  columns = tuple(read_only_array(column) for column in columns)
+  if len(columns) != n_axes:
+    raise ValueError("Expected {} axes, got {}".format(n_axes, len(columns)))
+  return columns
+
+# ------------------------------------------------------------------------------
+
+class Distribution:
+  """ Class holding the bin values of a distribution together with the lower 
+      and upper bin edges of each row on each axis and the file metadata.
+      All arrays are contiguous read-only float64 arrays, edges and centers
+      are held as one array per axis. Columns of a ColumnStore stay memory 
+      mapped and the access functions return views (no copies).
+  """
+  
+  __slots__ = ("metadata", "axes", "values", "lower", "upper", "centers", 
+               "_binning", "_dense", "_projections")
+  
+  value_column = "Cross sections"
+  
+  # --- Constructor ------------------------------------------------------------
+  
+  def __init__(self, values, lower, upper, axes, metadata=None, centers=None):
+    """ values ... Bin values (n_rows)
+        lower, upper ... Bin edges, one column (n_rows) per axis
+        axes ... Names of the axes
+        centers ... Bin centers, one column per axis, default middle of edges
+    """
+    self.axes = tuple(axes)
+    self.metadata = dict(metadata) if metadata is not None else {}
+    self.values = read_only_array(values)
+    self.lower = read_only_columns(lower, len(self.axes))
+    self.upper = read_only_columns(upper, len(self.axes))
+    if centers is None:
+      centers = [0.5 * (low + up) for low, up in zip(self.lower, self.upper)]
+    self.centers = read_only_columns(centers, len(self.axes))
+    self._binning = None
+    self._dense = None
+    self._projections = {}
+    
+  @classmethod
+  def from_reader(cls, reader):
+    """ Create the distribution from a Reader (or a ColumnStore).
+    """
+    return cls.from_data(reader.data)
+  
+  @classmethod
+  def from_data(cls, data):
+    """ Create the distribution from data in the Reader format (metadata 
+        entries and "Data" columns), e.g. a chunk from Reader.read_chunks.
+    """
+    metadata = {ID: value for ID, value in data.items() if ID != "Data"}
+    columns = data["Data"]
+    axes = [column.split(":",1)[1] for column in columns 
+            if column.startswith("BinLow:")]
+    centers = None
+    if all("BinCenters:{}".format(axis) in columns for axis in axes):
+      centers = [columns["BinCenters:{}".format(axis)] for axis in axes]
+    return cls(
+      columns[cls.value_column], 
+      [columns["BinLow:{}".format(axis)] for axis in axes],
+      [columns["BinUp:{}".format(axis)] for axis in axes],
+      axes, metadata, centers)
+  
+  @classmethod
+  def from_file(cls, file_path, **reader_kwargs):
+    """ Read the distribution from the given CSV file.
+    """
+    return cls.from_reader(IOR.Reader(file_path, **reader_kwargs))
+  
+  # --- Access functions -------------------------------------------------------
+  
+  def __len__(self):
+    """ Number of rows (bins) in the distribution.
+    """
+    return len(self.values)
+  
+  def n_axes(self):
+    """ Number of axes (dimensions) of the distribution.
+    """
+    return len(self.axes)
+  
+  def axis_index(self, axis):
+    """ Index of the axis given by name (or index).
+    """
+    return axis if isinstance(axis, (int, np.integer)) else self.axes.index(axis)
+  
+  def low(self, axis):
+    """ Lower bin edges of each row on the given axis.
+    """
+    return self.lower[self.axis_index(axis)]
+  
+  def up(self, axis):
+    """ Upper bin edges of each row on the given axis.
+    """
+    return self.upper[self.axis_index(axis)]
+  
+  def center(self, axis):
+    """ Bin centers of each row on the given axis.
+    """
+    return self.centers[self.axis_index(axis)]
+  
+  def width(self, axis):
+    """ Bin widths of each row on the given axis.
+    """
+    return self.up(axis) - self.low(axis)
+  
+  def range(self, axis):
+    """ Lowest and highest bin edge on the given axis.
+    """
+    return np.amin(self.low(axis)), np.amax(self.up(axis))
+  
+  def axis_edges(self, axis):
+    """ Sorted distinct bin edges on the given axis.
+    """
+    return self.binning().edges(axis)
+  
+  def binning(self):
+    """ Exact binning of the distribution (reconstructed once from the edges).
+    """
+    if self._binning is None:
+      self._binning = DB.Binning(self.lower, self.upper, self.axes)
+    return self._binning
+  
+  def dense(self):
+    """ Dense ndarray of the values on the binning (created once).
+    """
+    if self._dense is None:
+      self._dense = DP.dense(self.values, self.binning())
+      self._dense.flags.writeable = False
+    return self._dense
+  
+  def projections(self, max_dim=2):
+    """ All marginal projections with up to max_dim axes (see 
+        Projections.marginal_projections), computed once and cached.
+    """
+    n_axes = self.n_axes()
+    if any(axes not in self._projections 
+           for dim in range(1, min(max_dim, n_axes)+1) 
+           for axes in itertools.combinations(range(n_axes), dim)):
+      self._projections.update(DP.marginal_projections(self.dense(), max_dim))
+    return self._projections
+  
+  def projection(self, *axes):
+    """ Marginal projection onto the given axes (names or indices, in that 
+        order), cached on the distribution.
+    """
+    indices = tuple(self.axis_index(axis) for axis in axes)
+    key = tuple(sorted(indices))
+    if key not in self._projections:
+      self._projections[key] = DP.project(self.dense(), key)
+    return np.transpose(self._projections[key], np.argsort(np.argsort(indices)))
+
+# ------------------------------------------------------------------------------
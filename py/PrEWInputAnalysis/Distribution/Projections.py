@@ -0,0 +1,52 @@
+# ------------------------------------------------------------------------------
+
+""" Dense N-dimensional representation of a binned distribution and its
+    marginal projections.
+"""
+
+# ------------------------------------------------------------------------------
+
+import itertools
+import numpy as np
+
+# ------------------------------------------------------------------------------
+
+def dense(values, binning):
+  """ Dense ndarray (of the binning shape) with the sum of the row values in
+      each bin.
+  """
+  return np.bincount(binning.flat_indices, weights=values,
+                     minlength=binning.n_bins()).reshape(binning.shape)
+
+def project(dense_values, axes):
+  """ Marginal projection of the dense array onto the given axis indices (in
+      the given order), summing over all other axes.
+  """
+  summed_axes = tuple(i for i in range(dense_values.ndim) if i not in axes)
+  projection = np.sum(dense_values, axis=summed_axes)
+  # Remaining axes are in increasing order, bring them into requested order
+  return np.transpose(projection, np.argsort(np.argsort(axes)))
+
+def marginal_projections(dense_values, max_dim=2):
+  """ All marginal projections with up to max_dim axes, as dict from the
+      (increasing) tuple of axis indices to the projected array.
+      Lower dimensional projections are summed from the higher dimensional
+      ones instead of the full array.
+  """
+  n_dim = dense_values.ndim
+  projections = {}
+  for dim in range(min(max_dim, n_dim), 0, -1):
+    for axes in itertools.combinations(range(n_dim), dim):
+      # Smallest already known projection that contains these axes
+      parents = [parent for parent in projections
+                 if len(parent) == dim+1 and set(axes) <= set(parent)]
+      if parents:
+        parent = parents[0]
+        projections[axes] = np.sum(projections[parent],
+                                   axis=[parent.index(i) for i in parent
+                                         if i not in axes][0])
+      else:
+        projections[axes] = project(dense_values, axes)
+  return projections
+
+# ------------------------------------------------------------------------------
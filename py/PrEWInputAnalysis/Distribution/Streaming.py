@@ -0,0 +1,118 @@
+# ------------------------------------------------------------------------------
+
+""" Accumulation of totals, projections and chi-squared sums over the chunks of
+    a distribution file (see IO.Reader.read_chunks), so that memory stays
+    bounded independent of the file size.
+"""
+
+# ------------------------------------------------------------------------------
+
+import itertools
+import numpy as np
+
+# Local modules
+import Distribution.Binning as DB
+import Distribution.Distribution as DD
+import IO.Reader as IOR
+
+# ------------------------------------------------------------------------------
+
+# Columns needed for the accumulation (bin centers are not)
+stream_columns = [DD.Distribution.value_column, "BinLow:*", "BinUp:*"]
+
+def accumulate(file_path, accumulators, chunk_size=100000,
+               columns=stream_columns):
+  """ Read the file chunk by chunk and add each chunk (as Distribution) to
+      all accumulators. Returns the accumulators.
+  """
+  for chunk in IOR.read_chunks(file_path, chunk_size, columns):
+    distr = DD.Distribution.from_data(chunk)
+    for accumulator in accumulators:
+      accumulator.add(distr)
+  return accumulators
+
+def scan_edges(file_path, chunk_size=100000):
+  """ Find the edge array of each axis in a first pass over the file.
+      Returns the axis names and the list of edge arrays.
+  """
+  collector, = accumulate(file_path, [EdgeCollector()], chunk_size)
+  return collector.axes, collector.edges()
+
+# ------------------------------------------------------------------------------
+
+class EdgeCollector:
+  """ Accumulator of the distinct bin edges on each axis.
+  """
+
+  def __init__(self, rtol=1e-9):
+    self.rtol = rtol
+    self.axes = None
+    self.axis_edges = None
+
+  def add(self, distr):
+    """ Add the edges of the chunk.
+    """
+    if self.axes is None:
+      self.axes = distr.axes
+      self.axis_edges = [np.empty(0) for _ in distr.axes]
+    self.axis_edges = [
+      DB.merge_edges(np.concatenate((edges, distr.low(i), distr.up(i))), self.rtol)
+      for i, edges in enumerate(self.axis_edges) ]
+
+  def edges(self):
+    """ Edge arrays of all axes.
+    """
+    return self.axis_edges
+
+# ------------------------------------------------------------------------------
+
+class ProjectionAccumulator:
+  """ Accumulator of the total and all marginal projections with up to max_dim
+      axes on a known binning (e.g. from scan_edges).
+      Projections are keyed like in Projections.marginal_projections.
+  """
+
+  def __init__(self, axis_edges, max_dim=2):
+    self.axis_edges = [np.asarray(edges) for edges in axis_edges]
+    shape = tuple(len(edges) - 1 for edges in self.axis_edges)
+    self.total = 0.0
+    self.projections = {
+      axes: np.zeros([shape[i] for i in axes])
+      for dim in range(1, min(max_dim, len(shape))+1)
+      for axes in itertools.combinations(range(len(shape)), dim) }
+
+  def add(self, distr):
+    """ Add the values of the chunk.
+    """
+    indices = [DB.bin_indices(edges, distr.low(i), distr.up(i))
+               for i, edges in enumerate(self.axis_edges)]
+    self.total += np.sum(distr.values)
+    for axes, projection in self.projections.items():
+      flat = np.ravel_multi_index([indices[i] for i in axes], projection.shape)
+      projection += np.bincount(flat, weights=distr.values,
+                                minlength=projection.size).reshape(projection.shape)
+
+# ------------------------------------------------------------------------------
+
+class ChiSquaredAccumulator:
+  """ Accumulator of the chi-squared of a model w.r.t. the values (see
+      ShapeTesting.chi_squared), where model(distr) returns the expected
+      values of the rows of a chunk.
+  """
+
+  def __init__(self, model, scale=1.0):
+    """ scale ... Factor applied to the values before comparing (e.g. lumi)
+    """
+    self.model = model
+    self.scale = scale
+    self.chi_squared = 0.0
+    self.n_bins = 0
+
+  def add(self, distr):
+    """ Add the chi-squared contribution of the chunk.
+    """
+    bin_vals = self.scale * distr.values
+    self.chi_squared += np.sum((bin_vals - self.model(distr))**2 / bin_vals)
+    self.n_bins += len(distr)
+
+# ------------------------------------------------------------------------------
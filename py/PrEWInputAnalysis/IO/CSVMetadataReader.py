@@ -1,5 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
 import logging as log
 import numpy as np
+import pandas as pd
+
+# Local modules
+import IO.SysHelpers as IOSH
+
+# ------------------------------------------------------------------------------
+
+def read_header(file_path, block_size=1024):
+  """ Read the metadata header of the file (up to and including the end marker
+      line) without reading the data body beyond the current block.
+  """
+  end_marker = CSVMetadataReader.end_marker.encode()
+  header = b''
+  with open(file_path, 'rb', buffering=0) as read_obj:
+    for block in iter(lambda: read_obj.read(block_size), b''):
+      # Search from before the block start in case the marker is split
+      search_start = max(len(header) - len(end_marker), 0)
+      header += block
+      end = header.find(end_marker, search_start)
+      if end >= 0:
+        line_end = header.find(b'\n', end)
+        return header[:line_end+1 if line_end >= 0 else len(header)].decode()
+  raise ValueError("No {} in {}".format(CSVMetadataReader.end_marker, file_path))
+
+def read_metadata(file_path):
+  """ Metadata of the file, reading only the header.
+  """
+  return CSVMetadataReader(file_path, header_only=True).metadata
+
+def scan_metadata(dir, extension=".csv", n_threads=8):
+  """ Read the metadata of all files in the directory tree in parallel threads.
+      Returns a DataFrame with the file path and one column per metadata ID.
+  """
+  file_paths = IOSH.find_files(dir, extension, recursive=True)
+  with ThreadPoolExecutor(max_workers=n_threads) as executor:
+    metadata = list(executor.map(read_metadata, file_paths))
+  return pd.DataFrame([dict(File=file_path, **file_metadata) 
+                       for file_path, file_metadata in zip(file_paths, metadata)])
 
 # ------------------------------------------------------------------------------
 
@@ -14,17 +54,23 @@ class CSVMetadataReader:
   int_data = ["Energy", "e-Chirality", "e+Chirality"]
   float_data = ["Coef|MuonAcc_CutValue"]
 
-  def __init__(self, csv_path):
+  def __init__(self, csv_source, header_only=False):
+    """ csv_source ... Path of the CSV file or an open file object, which is 
+                       left positioned at the CSV header line after reading
+        header_only ... Only read the bytes up to the end marker from the path
+    """
     self.metadata = {}
     self.data_header_line = None
-    self.interpret(csv_path)
+    if header_only and not hasattr(csv_source, "readline"):
+      csv_source = io.StringIO(read_header(csv_source))
+    self.interpret(csv_source)
 
   # --- Access functions -------------------------------------------------------
 
   def __getitem__(self,index):
     """ Define what happens when the [] operator is applied (only reading).
     """
-    return self.metadata[metadata_ID]
+    return self.metadata[index]
       
   def get_data_header_line(self):
     """ Get the line index at which the actual CSV data starts.
@@ -33,26 +79,34 @@ class CSVMetadataReader:
 
   # --- Internal functions -----------------------------------------------------
     
-  def find_metadata_lines(self, csv_path):
+  def find_metadata_lines(self, csv_source):
     """ Find the lines in the given file that correspond to the metadata.
     """
+    if hasattr(csv_source, "readline"):
+      return self.read_metadata_lines(csv_source)
+    with open(csv_source, 'r') as read_obj:
+      return self.read_metadata_lines(read_obj)
+    
+  def read_metadata_lines(self, read_obj):
+    """ Read the metadata lines from an open file object, stopping right after
+        the end marker.
+    """
     # Look line by line
     line_index = 0
     in_metadata = False
     metadata_lines = [] 
-    with open(csv_path, 'r') as read_obj:
-      # Check line by line
-      for line in read_obj:
-        line_index += 1
-        line = line.strip() # Remove trailing/leading whitespaces etc.
-        if self.end_marker in line:
-          break
-        elif self.begin_marker in line:
-          in_metadata = True
-        elif in_metadata:
-          metadata_lines.append(line)
-        else:
-          raise ValueError("Unexpected line before CSV Metadata: {}".format(line))
+    # Check line by line (readline keeps the file position at the data)
+    for line in iter(read_obj.readline, ''):
+      line_index += 1
+      line = line.strip() # Remove trailing/leading whitespaces etc.
+      if self.end_marker in line:
+        break
+      elif self.begin_marker in line:
+        in_metadata = True
+      elif in_metadata:
+        metadata_lines.append(line)
+      else:
+        raise ValueError("Unexpected line before CSV Metadata: {}".format(line))
       
     self.data_header_line = line_index
     return metadata_lines
@@ -69,11 +123,11 @@ class CSVMetadataReader:
       
     return data
     
-  def interpret(self, csv_path):
+  def interpret(self, csv_source):
     """ Interpret the metadata lines found in the CSV file.
     """
     # Split each line by the ":" separator and store its value
-    for line in self.find_metadata_lines(csv_path):
+    for line in self.find_metadata_lines(csv_source):
       log.debug("Interpreting line: {}".format(line))
       ID, data_str = line.split(":")
       data_str = data_str.strip() # Remove trailing/leading whitespaces etc.
@@ -0,0 +1,137 @@
+# ------------------------------------------------------------------------------
+
+""" Catalogue of the input files in a directory tree: file name fields and CSV
+    metadata of each file in a queryable index that is persisted to disk.
+"""
+
+# ------------------------------------------------------------------------------
+
+import json
+import logging as log
+import os
+import tempfile
+
+# Local modules
+import IO.CSVMetadataReader as CMR
+import IO.FilenameHelp as IOFH
+import IO.SysHelpers as IOSH
+
+# ------------------------------------------------------------------------------
+
+index_file = "catalogue.json"
+
+def file_entry(file_path):
+  """ Catalogue entry of the file: path, file name fields and metadata.
+  """
+  stat = os.stat(file_path)
+  entry = {"path": file_path, "file_name": os.path.basename(file_path),
+           "stat": [stat.st_mtime_ns, stat.st_size]}
+  entry.update(IOFH.parse_file_name(file_path))
+  entry["metadata"] = CMR.read_metadata(file_path)
+  return entry
+
+def matches(entry, criteria):
+  """ Check whether the entry fulfills all criteria. Keys are entry fields or
+      metadata IDs, values are either the required value or a function
+      returning whether the value is accepted.
+  """
+  for key, required in criteria.items():
+    value = entry[key] if key in entry else entry["metadata"].get(key)
+    if callable(required):
+      if not required(value):
+        return False
+    elif value != required:
+      return False
+  return True
+
+# ------------------------------------------------------------------------------
+
+class Catalogue:
+  """ Class holding the catalogue entries of all input files below a root
+      directory.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, root_dir, extension=".csv", index_path=None):
+    """ root_dir ... Directory that is scanned recursively
+        index_path ... File in which the index is persisted
+                       (default: catalogue.json in the root directory)
+    """
+    self.root_dir = root_dir
+    self.extension = extension
+    self.index_path = index_path or "{}/{}".format(root_dir, index_file)
+    self.entries = {}
+    if os.path.isfile(self.index_path):
+      with open(self.index_path, 'r') as read_obj:
+        self.entries = json.load(read_obj)
+
+  @classmethod
+  def scan(cls, root_dir, extension=".csv", index_path=None):
+    """ Catalogue of the directory tree, only (re-)reading files that changed
+        since the index was last saved. The updated index is saved.
+    """
+    catalogue = cls(root_dir, extension, index_path)
+    if catalogue.update():
+      catalogue.save()
+    return catalogue
+
+  # --- Access functions -------------------------------------------------------
+
+  def __len__(self):
+    return len(self.entries)
+
+  def select(self, **criteria):
+    """ All entries that fulfill the criteria (see matches), sorted by path.
+    """
+    return [self.entries[path] for path in sorted(self.entries)
+            if matches(self.entries[path], criteria)]
+
+  def select_one(self, **criteria):
+    """ The single entry that fulfills the criteria.
+    """
+    selected = self.select(**criteria)
+    if len(selected) != 1:
+      raise ValueError("Expected one file for {}, found {}".format(
+                       criteria, [entry["path"] for entry in selected]))
+    return selected[0]
+
+  def partner(self, entry, keys, **criteria):
+    """ The single entry that agrees with the given entry in the keys and
+        fulfills the additional criteria (e.g. the true-angle file for a file).
+    """
+    criteria.update({key: entry[key] if key in entry else entry["metadata"][key]
+                     for key in keys})
+    return self.select_one(**criteria)
+
+  # --- Modifying functions ----------------------------------------------------
+
+  def update(self):
+    """ Rescan the directory tree, adding new and changed files and removing
+        deleted ones. Returns whether the index changed.
+    """
+    file_paths = IOSH.find_files(self.root_dir, self.extension, recursive=True)
+    changed = False
+    for file_path in file_paths:
+      entry = self.entries.get(file_path)
+      stat = os.stat(file_path)
+      if entry is None or entry["stat"] != [stat.st_mtime_ns, stat.st_size]:
+        log.debug("Cataloguing {}".format(file_path))
+        self.entries[file_path] = file_entry(file_path)
+        changed = True
+    for file_path in set(self.entries) - set(file_paths):
+      del self.entries[file_path]
+      changed = True
+    return changed
+
+  def save(self):
+    """ Write the index to its file.
+    """
+    index_dir = os.path.dirname(os.path.abspath(self.index_path))
+    IOSH.create_dir(index_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+    with os.fdopen(fd, 'w') as write_obj:
+      json.dump(self.entries, write_obj, indent=1)
+    IOSH.replace_file(tmp_path, self.index_path)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,131 @@
+# ------------------------------------------------------------------------------
+
+""" Columnar on-disk format for distributions: one .npy file per data column
+    plus a JSON file with the metadata. The columns are loaded as read-only
+    memory maps, so several processes share one copy of the data.
+"""
+
+# ------------------------------------------------------------------------------
+
+import json
+import numpy as np
+import os
+import tempfile
+
+# Local modules
+import IO.Reader as IOR
+import IO.SysHelpers as IOSH
+
+# ------------------------------------------------------------------------------
+
+index_file = "columns.json"
+
+def store_dir(file_path, store_root):
+  """ Directory in which the column store of the given CSV file is placed.
+  """
+  base_name = os.path.basename(file_path).replace(".csv","")
+  return "{}/{}".format(store_root, base_name)
+
+def file_stat(file_path):
+  """ Modification time and size identifying the version of the file.
+  """
+  stat = os.stat(file_path)
+  return [stat.st_mtime_ns, stat.st_size]
+
+def write_atomic(file_path, write_func):
+  """ Write the file via write_func(file object) into a temporary file that
+      then replaces it, so that processes which still memory map the old file
+      keep seeing its complete content.
+  """
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+  with os.fdopen(fd, 'wb') as write_obj:
+    write_func(write_obj)
+  IOSH.replace_file(tmp_path, file_path)
+
+def write(out_dir, data, source=None):
+  """ Write the reader data (metadata entries and the "Data" DataFrame) into
+      the column store directory.
+      source ... Version of the converted file (see file_stat), recorded to 
+                 detect when the store is outdated
+  """
+  IOSH.create_dir(out_dir)
+  index_path = "{}/{}".format(out_dir, index_file)
+  if os.path.isfile(index_path):
+    os.remove(index_path) # Store incomplete until rewritten
+  df = data["Data"]
+  metadata = {ID: value for ID, value in data.items() if ID != "Data"}
+
+  column_files = {}
+  for i, column in enumerate(df.columns):
+    values = np.asarray(df[column])
+    if values.dtype.kind not in "biuf":
+      values = values.astype(str)
+    values = np.ascontiguousarray(values)
+    column_files[column] = "col_{}.npy".format(i)
+    write_atomic("{}/{}".format(out_dir, column_files[column]),
+                 lambda write_obj: np.save(write_obj, values))
+
+  # Index is written last, an existing index means a complete store
+  index = {"metadata": metadata, "columns": column_files, "source": source}
+  write_atomic(index_path, 
+               lambda write_obj: write_obj.write(json.dumps(index).encode()))
+
+def convert(file_path, store_root):
+  """ Convert the CSV distribution file into a column store, returns the store
+      directory.
+  """
+  out_dir = store_dir(file_path, store_root)
+  source = file_stat(file_path) # Before reading, a later change makes it stale
+  write(out_dir, IOR.Reader(file_path).data, source)
+  return out_dir
+
+def update(file_path, store_root):
+  """ Column store of the CSV file, (re-)converted if it is missing or was
+      converted from another version of the file (modification time or size 
+      differ, also if the file was replaced by an older one). Returns the 
+      store directory.
+  """
+  out_dir = store_dir(file_path, store_root)
+  index_path = "{}/{}".format(out_dir, index_file)
+  source = None
+  if os.path.isfile(index_path):
+    with open(index_path, 'r') as read_obj:
+      source = json.load(read_obj).get("source")
+  if source != file_stat(file_path):
+    convert(file_path, store_root)
+  return out_dir
+
+# ------------------------------------------------------------------------------
+
+class ColumnStore:
+  """ Class to load a distribution from a column store directory.
+      Can be used like a Reader, but "Data" is a dict of read-only memory
+      mapped column arrays instead of a DataFrame.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, in_dir):
+    self.data = {}
+    self.interpret(in_dir)
+
+  # --- Access functions -------------------------------------------------------
+
+  def __getitem__(self,index):
+    """ Define what happens when the [] operator is applied (only reading).
+    """
+    return self.data[index]
+
+  # --- Internal functions -----------------------------------------------------
+
+  def interpret(self, in_dir):
+    """ Read the index and memory map the columns.
+    """
+    with open("{}/{}".format(in_dir, index_file), 'r') as read_obj:
+      index = json.load(read_obj)
+    self.data = index["metadata"]
+    self.data["Data"] = {
+      column: np.load("{}/{}".format(in_dir, file_name), mmap_mode='r')
+      for column, file_name in index["columns"].items() }
+
+# ------------------------------------------------------------------------------
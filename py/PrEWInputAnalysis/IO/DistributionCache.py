@@ -0,0 +1,122 @@
+# ------------------------------------------------------------------------------
+
+""" On-disk cache of parsed distribution files (metadata and data columns) in
+    the binary .npz format.
+    Only the latest version of each file (per column selection) is kept, the 
+    whole cache can be cleared by deleting its directory (see default_dir).
+"""
+
+# ------------------------------------------------------------------------------
+
+import glob
+import hashlib
+import json
+import logging as log
+import numpy as np
+import os
+import pandas as pd
+import tempfile
+import zipfile
+
+# Local modules
+import IO.SysHelpers as IOSH
+
+# ------------------------------------------------------------------------------
+# Keys
+
+def cache_key(file_path, columns=None, mode="stat"):
+  """ Key under which the parsed file is cached, made of a part identifying
+      the file path and column selection and a part identifying its version.
+      mode ... "stat": modification time and size identify the version
+               "content": content hash identifies the version
+  """
+  file_path = os.path.abspath(file_path)
+  if mode == "stat":
+    stat = os.stat(file_path)
+    file_id = [stat.st_mtime_ns, stat.st_size]
+  elif mode == "content":
+    file_id = IOSH.file_hash(file_path)
+  else:
+    raise ValueError("Unknown cache key mode {}".format(mode))
+
+  path_str = json.dumps([file_path, columns])
+  version_str = json.dumps(file_id)
+  return "{}_{}".format(hashlib.sha1(path_str.encode()).hexdigest(),
+                        hashlib.sha1(version_str.encode()).hexdigest())
+
+def default_dir():
+  """ Per-user cache directory: $PREW_CACHE_DIR if set (empty: no cache), 
+      otherwise PrEWShapeChecks in $XDG_CACHE_HOME or ~/.cache.
+  """
+  if "PREW_CACHE_DIR" in os.environ:
+    return os.environ["PREW_CACHE_DIR"] or None
+  cache_home = os.environ.get("XDG_CACHE_HOME") or \
+               os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(cache_home, "PrEWShapeChecks")
+
+# ------------------------------------------------------------------------------
+# Storing / loading
+
+def cache_path(cache_dir, key):
+  """ Path of the cache file with the given key.
+  """
+  return "{}/{}.npz".format(cache_dir, key)
+
+def remove(cache_dir, key):
+  """ Remove the cache file with the given key (if it exists).
+  """
+  try:
+    os.remove(cache_path(cache_dir, key))
+  except FileNotFoundError:
+    pass
+
+def remove_superseded(cache_dir, key):
+  """ Remove the cache files of other versions of the file with the given key.
+  """
+  path_key = key.split("_")[0]
+  for path in glob.glob(cache_path(cache_dir, path_key + "_*")):
+    if path != cache_path(cache_dir, key):
+      remove(cache_dir, os.path.basename(path)[:-len(".npz")])
+
+def store(cache_dir, key, data):
+  """ Store the reader data (metadata entries and the "Data" DataFrame) in the
+      cache, replacing older versions of the same file.
+  """
+  IOSH.create_dir(cache_dir)
+  df = data["Data"]
+  metadata = {ID: value for ID, value in data.items() if ID != "Data"}
+  arrays = {"col_{}".format(i): np.asarray(df[column]) if df[column].dtype.kind in "biuf"
+                                else np.asarray(df[column], dtype=str)
+            for i, column in enumerate(df.columns)}
+
+  # Write to temporary file first so that no partial cache files exist
+  fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+  with os.fdopen(fd, 'wb') as write_obj:
+    np.savez(write_obj, columns=np.array(df.columns, dtype=str),
+             metadata=np.array(json.dumps(metadata)), **arrays)
+  IOSH.replace_file(tmp_path, cache_path(cache_dir, key))
+  remove_superseded(cache_dir, key)
+
+def load(cache_dir, key):
+  """ Load the reader data with the given key from the cache, None if it is
+      not cached. Unreadable (e.g. truncated) cache files are removed.
+  """
+  path = cache_path(cache_dir, key)
+  if not os.path.isfile(path):
+    return None
+
+  try:
+    with np.load(path, allow_pickle=False) as npz:
+      data = json.loads(str(npz["metadata"]))
+      data["Data"] = pd.DataFrame({
+        column: npz["col_{}".format(i)] for i, column in enumerate(npz["columns"])})
+  except (OSError, ValueError, KeyError, zipfile.BadZipFile) as error:
+    log.warning("Removing unreadable cache file {}: {}".format(path, error))
+    try:
+      remove(cache_dir, key)
+    except OSError:
+      pass
+    return None
+  return data
+
+# ------------------------------------------------------------------------------
@@ -1,8 +1,18 @@
 """ Helper functions related to file name conventions.
 """
 
+import functools
+import os
 import re
 
+# Patterns of the file name fields (compiled once)
+chirality_pattern = re.compile(r"e(L|R)p(L|R)")
+eM_chi_pattern = re.compile(r"e(L|R)")
+eP_chi_pattern = re.compile(r"p(L|R)")
+lep_charge_pattern = re.compile(r"(e|mu|tau)(minus|plus)")
+process_pattern = re.compile(r"^\d+f_[A-Za-z]+") # e.g. 2f_mu, 4f_WW
+
+@functools.lru_cache(maxsize=None)
 def find_Z_direction(file_path):
   """ Find the Z direction in the file path.
   """
@@ -12,7 +22,8 @@ def find_Z_direction(file_path):
     return "FZ"
   else:
     return None
-    
+
+@functools.lru_cache(maxsize=None)
 def find_2f_mass_label(file_path):
   """ Find the mass label of the 2f process in the file path.
   """
@@ -23,13 +34,15 @@ def find_2f_mass_label(file_path):
   else:
     raise Exception("Could not find 2f mass label in ", file_path)
 
+@functools.lru_cache(maxsize=None)
 def find_chirality(file_path):
   """ Find the chirality in the given file path.
   """
-  eM_chi = re.search(r"e(L|R)",file_path).group(0)
-  eP_chi = re.search(r"p(L|R)",file_path).group(0)
+  eM_chi = eM_chi_pattern.search(file_path).group(0)
+  eP_chi = eP_chi_pattern.search(file_path).group(0)
   return "{}{}".format(eM_chi,eP_chi)
 
+@functools.lru_cache(maxsize=None)
 def find_lep_charge(file_path, lep):
   """ Find the chirality in the given file path.
   """
@@ -38,4 +51,24 @@ def find_lep_charge(file_path, lep):
   elif lep+"plus" in file_path:
     return +1
   else:
-    raise Exception("Did not find {} charge in {}".format(lep, file_path))
\ No newline at end of file
+    raise Exception("Did not find {} charge in {}".format(lep, file_path))
+
+def parse_file_name(file_path):
+  """ All fields that can be found in the file name as dict, fields that are
+      not present are None.
+  """
+  file_name = os.path.basename(file_path)
+  process = process_pattern.search(file_name)
+  chirality = chirality_pattern.search(file_name)
+  lep_charge = lep_charge_pattern.search(file_name)
+  mass_label = None
+  if "180to275" in file_name or "81to101" in file_name:
+    mass_label = find_2f_mass_label(file_name)
+  return {
+    "process": process.group(0) if process else None,
+    "chirality": chirality.group(0) if chirality else None,
+    "Z_direction": find_Z_direction(file_name),
+    "mass_label": mass_label,
+    "lepton": lep_charge.group(1) if lep_charge else None,
+    "lep_charge": (-1 if lep_charge.group(2) == "minus" else +1) if lep_charge else None,
+    "true_angle": "_true_" in file_name }
@@ -0,0 +1,121 @@
+# ------------------------------------------------------------------------------
+
+""" Loader that reads the next input files in background threads while the
+    current one is processed, to hide the I/O latency of (network) mounts.
+"""
+
+# ------------------------------------------------------------------------------
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging as log
+import threading
+import time
+
+# Local modules
+import IO.Reader as IOR
+import IO.SysHelpers as IOSH
+
+# ------------------------------------------------------------------------------
+
+class LoadStats:
+  """ Timing statistics of a prefetching loop.
+      io_wait ... Time the loop waited for a load to finish
+      compute ... Time spent processing between loads
+      load ... Summed time of the loads themselves (in the threads)
+  """
+
+  def __init__(self):
+    self.n_items = 0
+    self.io_wait = 0.0
+    self.compute = 0.0
+    self.load = 0.0
+
+  def summary(self):
+    """ One-line summary of the statistics.
+    """
+    return ("{} items: I/O wait {:.2f}s, compute {:.2f}s, "
+            "load (in threads) {:.2f}s").format(self.n_items, self.io_wait,
+                                                self.compute, self.load)
+
+# ------------------------------------------------------------------------------
+
+class PrefetchLoader:
+  """ Iterable over (item, loaded object) pairs, where load(item) is executed
+      in a thread pool up to queue_depth items ahead of the consumer.
+      Items are returned in their original order.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, items, load=IOR.Reader, queue_depth=2, n_threads=None):
+    """ items ... Items to load (e.g. file paths)
+        load ... Function loading one item
+        queue_depth ... Maximum number of loads ahead of the consumer
+        n_threads ... Threads used for loading (default: queue_depth)
+    """
+    if queue_depth < 1:
+      raise ValueError("Queue depth must be at least 1, got {}".format(queue_depth))
+    self.items = list(items)
+    self.load = load
+    self.queue_depth = queue_depth
+    self.n_threads = n_threads or queue_depth
+    self.stats = LoadStats()
+    self.stats_lock = threading.Lock()
+
+  @classmethod
+  def from_dir(cls, dir, extension, **kwargs):
+    """ Loader for all files of the given extension in the directory.
+    """
+    return cls(IOSH.find_files(dir, extension), **kwargs)
+
+  # --- Access functions -------------------------------------------------------
+
+  def __len__(self):
+    return len(self.items)
+
+  def __iter__(self):
+    self.stats = LoadStats()
+    items = iter(self.items)
+    with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+      pending = deque()
+
+      def submit_next():
+        for item in items:
+          pending.append((item, executor.submit(self.timed_load, item)))
+          return
+
+      for _ in range(self.queue_depth):
+        submit_next()
+
+      try:
+        while pending:
+          item, future = pending.popleft()
+          t_wait = time.perf_counter()
+          loaded = future.result()
+          self.stats.io_wait += time.perf_counter() - t_wait
+          submit_next()
+
+          t_compute = time.perf_counter()
+          yield item, loaded
+          self.stats.compute += time.perf_counter() - t_compute
+          self.stats.n_items += 1
+      finally:
+        # Consumer stopped early, do not start the remaining loads
+        for _, future in pending:
+          future.cancel()
+
+    log.info("Prefetching: {}".format(self.stats.summary()))
+
+  # --- Internal functions -----------------------------------------------------
+
+  def timed_load(self, item):
+    """ Load the item and add the load time to the statistics.
+    """
+    t_load = time.perf_counter()
+    loaded = self.load(item)
+    with self.stats_lock:
+      self.stats.load += time.perf_counter() - t_load
+    return loaded
+
+# ------------------------------------------------------------------------------
@@ -1,7 +1,32 @@
+import fnmatch
+import logging as log
 import pandas as pd
 
 # Local modules
 import IO.CSVMetadataReader as CMR
+import IO.DistributionCache as IODC
+
+# ------------------------------------------------------------------------------
+
+def column_selector(columns):
+  """ Create the column selection for pandas from a list of column names or 
+      shell-style patterns (e.g. "BinLow:*"), None selects all columns.
+  """
+  if columns is None:
+    return None
+  return lambda column: any(fnmatch.fnmatchcase(column, pattern) 
+                            for pattern in columns)
+
+def read_chunks(file_path, chunk_size=100000, columns=None):
+  """ Read the file in chunks of chunk_size rows without loading it as a whole.
+      Yields dicts like Reader.data: the metadata entries plus "Data" with the
+      DataFrame of the chunk.
+  """
+  with open(file_path, 'r') as read_obj:
+    metadata = CMR.CSVMetadataReader(read_obj).metadata
+    for chunk in pd.read_csv(read_obj, usecols=column_selector(columns), 
+                             chunksize=chunk_size):
+      yield dict(metadata, Data=chunk)
 
 # ------------------------------------------------------------------------------
 
@@ -9,11 +34,25 @@ class Reader:
   """ Class to read / interpret a distribution data file.
   """
   
+  # Default binary cache of the parsed files (None: no caching, default is the
+  # per-user cache, see DistributionCache.default_dir) and how cached files are
+  # identified (see DistributionCache.cache_key)
+  default_cache_dir = IODC.default_dir()
+  cache_key_mode = "stat"
+  
   # --- Constructor ------------------------------------------------------------
   
-  def __init__(self,file_path):
+  def __init__(self,file_path,columns=None,cache_dir=None):
+    """ columns ... Optional list of column names or patterns (e.g. 
+                    "BinLow:*") to load, default loads all columns
+        cache_dir ... Directory of the binary cache of parsed files, default 
+                      is Reader.default_cache_dir, False disables the cache
+    """
     self.data = {}
-    self.interpret(file_path)
+    if cache_dir is None:
+      cache_dir = Reader.default_cache_dir
+    self.cache_dir = cache_dir or None
+    self.interpret(file_path, columns)
     
   # --- Access functions -------------------------------------------------------
     
@@ -24,14 +63,35 @@ class Reader:
     
   # --- Internal functions -----------------------------------------------------
     
-  def interpret(self,file_path):
-    """ Read and interpret the input file.
+  def interpret(self,file_path,columns=None):
+    """ Read and interpret the input file, using the binary cache if possible.
     """
-    # Find and use the metadata
-    mr = CMR.CSVMetadataReader(file_path)
-    self.data = mr.metadata
+    if self.cache_dir is None:
+      self.data = self.parse(file_path, columns)
+      return
     
-    # Find the distribution data
-    self.data["Data"] = pd.read_csv(file_path, header=mr.get_data_header_line())
+    key = IODC.cache_key(file_path, columns, Reader.cache_key_mode)
+    self.data = IODC.load(self.cache_dir, key)
+    if self.data is None:
+      self.data = self.parse(file_path, columns)
+      try:
+        IODC.store(self.cache_dir, key, self.data)
+      except OSError as error:
+        # An unusable cache must not stop the reading
+        log.warning("Could not cache {}: {}".format(file_path, error))
     
-# ------------------------------------------------------------------------------
\ No newline at end of file
+  def parse(self,file_path,columns=None):
+    """ Parse the input file.
+        The file is opened only once, the metadata is read from its top and the
+        CSV parser continues right after it.
+    """
+    with open(file_path, 'r') as read_obj:
+      # Find and use the metadata
+      mr = CMR.CSVMetadataReader(read_obj)
+      data = mr.metadata
+      
+      # Find the distribution data
+      data["Data"] = pd.read_csv(read_obj, usecols=column_selector(columns))
+    return data
+    
+# ------------------------------------------------------------------------------
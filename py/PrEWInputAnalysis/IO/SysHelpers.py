@@ -5,23 +5,143 @@
 
 # ------------------------------------------------------------------------------
 
-from pathlib import Path
+import hashlib
+import json
 import os
+from pathlib import Path
+import tempfile
 
 # ------------------------------------------------------------------------------
 # Creating
 
+# Permissions of newly created files under the umask of the process (read once
+# at import, setting the umask to query it is not thread-safe)
+_umask = os.umask(0)
+os.umask(_umask)
+file_mode = 0o666 & ~_umask
+
 def create_dir(dir):
   """ Try to create the given directory and it's parents.
   """
   Path(dir).mkdir(parents=True, exist_ok=True)
 
+def replace_file(tmp_path, file_path):
+  """ Move the written temporary file (e.g. from tempfile.mkstemp) to the file
+      path, with the permissions of a normally created file (mkstemp creates
+      files only accessible by the owner).
+  """
+  os.chmod(tmp_path, file_mode)
+  os.replace(tmp_path, file_path)
+
 # ------------------------------------------------------------------------------
 # Finding
 
-def find_files(dir,extension):
-  """ Find all the files of a given extension in the directory.
+def find_files(dir, extension, recursive=False):
+  """ Find all the files of a given extension in the directory (and its 
+      subdirectories if recursive), sorted by path.
+  """
+  if not recursive:
+    return sorted("{}/{}".format(dir,dir_object) for dir_object in os.listdir(dir) 
+                  if dir_object.endswith(extension) and 
+                     os.path.isfile("{}/{}".format(dir,dir_object)))
+  
+  file_paths = []
+  for sub_dir, sub_dirs, file_names in os.walk(dir):
+    sub_dirs[:] = [name for name in sub_dirs if not name.startswith(".")]
+    file_paths += ["{}/{}".format(sub_dir,file_name) for file_name in file_names 
+                   if file_name.endswith(extension)]
+  return sorted(file_paths)
+
+# ------------------------------------------------------------------------------
+# Hashing
+
+def file_hash(file_path, block_size=1<<20):
+  """ SHA-1 hash of the content of the file.
+  """
+  sha = hashlib.sha1()
+  with open(file_path, 'rb') as read_obj:
+    for block in iter(lambda: read_obj.read(block_size), b''):
+      sha.update(block)
+  return sha.hexdigest()
+
+# ------------------------------------------------------------------------------
+# Incremental builds
+
+def json_normalized(obj):
+  """ The object as it is read back after storing it as JSON (e.g. tuples 
+      become lists), for comparisons with stored objects.
+  """
+  return json.loads(json.dumps(obj))
+
+class BuildManifest:
+  """ Class recording which inputs and configuration produced the outputs of 
+      each target (e.g. the plots of one input file), so that only stale 
+      targets need to be regenerated.
   """
-  return["{}/{}".format(dir,dir_object) for dir_object in os.listdir(dir) if extension in dir_object]
+  
+  # --- Constructor ------------------------------------------------------------
+  
+  def __init__(self, manifest_path):
+    self.manifest_path = manifest_path
+    self.targets = {}
+    self.hashes = {} # File path -> [mtime, size, hash] of known input files
+    if os.path.isfile(manifest_path):
+      with open(manifest_path, 'r') as read_obj:
+        stored = json.load(read_obj)
+      self.targets = stored["targets"]
+      self.hashes = stored["hashes"]
+  
+  # --- Access functions -------------------------------------------------------
+  
+  def input_hash(self, file_path):
+    """ Content hash of the input file, only re-hashed if its modification time
+        or size changed.
+    """
+    stat = os.stat(file_path)
+    known = self.hashes.get(file_path)
+    if known is None or known[:2] != [stat.st_mtime_ns, stat.st_size]:
+      known = [stat.st_mtime_ns, stat.st_size, file_hash(file_path)]
+      self.hashes[file_path] = known
+    return known[2]
+  
+  def is_stale(self, target, inputs, config=None):
+    """ Check whether the target needs to be regenerated, i.e. it was never 
+        built, one of its outputs is missing, or its inputs or configuration 
+        (e.g. script version and fit options) changed.
+    """
+    entry = self.targets.get(target)
+    if entry is None or entry["config"] != json_normalized(config):
+      return True
+    if not all(os.path.isfile(output) for output in entry["outputs"]):
+      return True
+    return entry["inputs"] != {input_path: self.input_hash(input_path) for input_path in inputs}
+  
+  def stale_targets(self, targets, config=None):
+    """ Select the stale targets among the given ones, where each target is 
+        an input file path that is its only input.
+    """
+    return [target for target in targets if self.is_stale(target, [target], config)]
+  
+  # --- Modifying functions ----------------------------------------------------
+  
+  def record(self, target, inputs, outputs, config=None):
+    """ Record that the target was built from the inputs with the given 
+        configuration, producing the outputs.
+    """
+    self.targets[target] = {
+      "inputs": {input_path: self.input_hash(input_path) for input_path in inputs},
+      "outputs": list(outputs),
+      "config": json_normalized(config) }
+  
+  def save(self):
+    """ Write the manifest to its file.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(self.manifest_path))
+    create_dir(manifest_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=manifest_dir, suffix=".tmp")
+    with os.fdopen(fd, 'w') as write_obj:
+      json.dump({"targets": self.targets, "hashes": self.hashes}, write_obj, 
+                indent=1)
+    replace_file(tmp_path, self.manifest_path)
 
 # ------------------------------------------------------------------------------
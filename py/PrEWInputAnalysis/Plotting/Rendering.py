@@ -0,0 +1,193 @@
+# ------------------------------------------------------------------------------
+
+""" Rendering of figures into all requested output formats from a single draw,
+    with the encoding and writing of the files done in background threads and
+    optionally all figures of a run bundled into one multi-page PDF.
+"""
+
+# ------------------------------------------------------------------------------
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging as log
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+import matplotlib.image as mimage
+import numpy as np
+import os
+
+# ------------------------------------------------------------------------------
+# Single figures
+
+def transparent_patches(fig):
+  """ Make figure and axes background transparent (like savefig(transparent)),
+      returns a function that restores the original colors.
+  """
+  patches = [fig.patch] + [ax.patch for ax in fig.axes]
+  colors = [(patch.get_facecolor(), patch.get_edgecolor()) for patch in patches]
+  for patch in patches:
+    patch.set_facecolor('none')
+    patch.set_edgecolor('none')
+
+  def restore():
+    for patch, (facecolor, edgecolor) in zip(patches, colors):
+      patch.set_facecolor(facecolor)
+      patch.set_edgecolor(edgecolor)
+  return restore
+
+def draw(fig):
+  """ Draw the figure once on its Agg canvas, returns the canvas and the tight
+      bounding box (in inches) that is used for all formats.
+      Figures on other canvases are not drawn here (None and "tight").
+  """
+  canvas = fig.canvas
+  if not isinstance(canvas, FigureCanvasAgg):
+    return None, "tight"
+  canvas.draw()
+  bbox = fig.get_tightbbox(canvas.get_renderer()).padded(
+    matplotlib.rcParams['savefig.pad_inches'])
+  return canvas, bbox
+
+def cropped_pixels(canvas, bbox, dpi):
+  """ Pixels of the drawn canvas inside the bounding box, None if the box
+      reaches outside of the figure (then the canvas does not contain it).
+  """
+  pixels = np.asarray(canvas.buffer_rgba())
+  height, width = pixels.shape[:2]
+  x0, x1 = int(np.floor(bbox.x0*dpi)), int(np.ceil(bbox.x1*dpi))
+  y0, y1 = int(np.floor(bbox.y0*dpi)), int(np.ceil(bbox.y1*dpi))
+  if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+    return None
+  # Pixel rows start at the top of the figure
+  return pixels[height-y1:height-y0, x0:x1].copy()
+
+def write_bytes(out_path, content):
+  """ Write the content into the file.
+  """
+  with open(out_path, 'wb') as write_obj:
+    write_obj.write(content)
+
+def write_png(out_path, pixels, dpi):
+  """ Encode the pixels as PNG file.
+  """
+  mimage.imsave(out_path, pixels, format="png", dpi=dpi)
+
+# ------------------------------------------------------------------------------
+
+class RenderPipeline:
+  """ Class rendering figures into their output files.
+      Each figure is drawn once on the calling thread (figures are not thread
+      safe), only encoding and file writing are left to the background
+      threads. Use close() (or the context manager) to wait for all writes.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, n_threads=2, multipage_path=None):
+    """ n_threads ... Threads writing the files (0: write synchronously)
+        multipage_path ... If given, all figures are also added as pages to
+                           this PDF file
+    """
+    self.executor = ThreadPoolExecutor(max_workers=n_threads) \
+                    if n_threads > 0 else None
+    self.pending = []
+    self.pdf_pages = PdfPages(multipage_path) if multipage_path else None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  # --- Rendering functions ----------------------------------------------------
+
+  def render(self, fig, out_paths):
+    """ Render the figure into all the output files (format given by the file
+        extension) with transparent background and tight bounding box.
+    """
+    restore = transparent_patches(fig)
+    try:
+      canvas, bbox = draw(fig)
+      dpi = fig.dpi if matplotlib.rcParams['savefig.dpi'] == 'figure' \
+            else matplotlib.rcParams['savefig.dpi']
+
+      pixels = None
+      for out_path in out_paths:
+        out_format = os.path.splitext(out_path)[1][1:].lower()
+        if out_format == "png" and canvas is not None and dpi == fig.dpi:
+          # Raster output directly from the existing draw if possible
+          pixels = cropped_pixels(canvas, bbox, dpi) if pixels is None else pixels
+          if pixels is not None:
+            self.submit(write_png, out_path, pixels, dpi)
+            continue
+        # Other formats rendered in memory with the fixed bounding box
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=out_format, bbox_inches=bbox, dpi=dpi,
+                    transparent=True)
+        self.submit(write_bytes, out_path, buffer.getvalue())
+
+      if self.pdf_pages is not None:
+        self.pdf_pages.savefig(fig, bbox_inches=bbox, transparent=True)
+    finally:
+      restore()
+
+  def close(self):
+    """ Wait for all pending writes and close the multi-page PDF.
+        Raises the first error that occurred while writing.
+    """
+    errors = []
+    for future in self.pending:
+      if future.exception() is not None:
+        log.error("Writing plot failed: {}".format(future.exception()))
+        errors.append(future.exception())
+    self.pending = []
+    if self.executor is not None:
+      self.executor.shutdown()
+      self.executor = None
+    if self.pdf_pages is not None:
+      self.pdf_pages.close()
+      self.pdf_pages = None
+    if errors:
+      raise errors[0]
+
+  # --- Internal functions -----------------------------------------------------
+
+  def submit(self, func, *args):
+    """ Run the writing function in the background (if threads are used).
+    """
+    if self.executor is None:
+      func(*args)
+    else:
+      self.pending = [future for future in self.pending if not future.done()
+                      or future.exception() is not None]
+      self.pending.append(self.executor.submit(func, *args))
+
+# ------------------------------------------------------------------------------
+# Pipeline shared by the plots of a process
+
+pipeline = None
+
+def configure(**kwargs):
+  """ Set up the shared pipeline (see RenderPipeline for the arguments),
+      closing the previous one.
+  """
+  global pipeline
+  close_pipeline()
+  pipeline = RenderPipeline(**kwargs)
+  return pipeline
+
+def get_pipeline():
+  """ The shared pipeline, created with default settings on first use.
+  """
+  return pipeline if pipeline is not None else configure()
+
+def close_pipeline():
+  """ Finish all writes of the shared pipeline.
+  """
+  global pipeline
+  if pipeline is not None:
+    pipeline.close()
+    pipeline = None
+
+# ------------------------------------------------------------------------------
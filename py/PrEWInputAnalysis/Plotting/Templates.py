@@ -0,0 +1,190 @@
+# ------------------------------------------------------------------------------
+
+""" Figure templates that build a plot layout once and only update the data
+    artists (step heights, image arrays, titles) for each new distribution.
+"""
+
+# ------------------------------------------------------------------------------
+
+import matplotlib.colors as mcolors
+import matplotlib.cm as mcm
+import matplotlib.pyplot as plt
+import numpy as np
+
+# Local modules
+import Plotting.Rendering as PR
+
+# ------------------------------------------------------------------------------
+# Template registry (per process)
+
+templates = {}
+
+def get_template(key, factory):
+  """ The template stored under the key, created by factory() on first use.
+  """
+  if key not in templates:
+    templates[key] = factory()
+  return templates[key]
+
+def release_templates():
+  """ Finish writing the plots and close the figures of all templates.
+  """
+  PR.close_pipeline()
+  for template in templates.values():
+    template.close()
+  templates.clear()
+
+# ------------------------------------------------------------------------------
+
+class FigureTemplate:
+  """ Base class of the templates, holding the figure.
+      Can be used as context manager which closes the figure at the end.
+  """
+
+  def __init__(self, fig):
+    self.fig = fig
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def save(self, out_paths):
+    """ Save the current state of the figure in the given files (written in 
+        the background by the shared render pipeline).
+    """
+    PR.get_pipeline().render(self.fig, out_paths)
+
+  def close(self):
+    """ Release the figure.
+    """
+    if self.fig is not None:
+      plt.close(self.fig)
+      self.fig = None
+
+# ------------------------------------------------------------------------------
+
+class StepTemplate(FigureTemplate):
+  """ Template of a single histogram drawn as steps.
+  """
+
+  def __init__(self, xlabel, ylabel, figsize=(6.5, 5), ymax_scale=None,
+               **step_kwargs):
+    """ ymax_scale ... If given, y range is 0 to ymax_scale times the automatic
+                       upper limit
+    """
+    fig = plt.figure(figsize=figsize, tight_layout=True)
+    super().__init__(fig)
+    self.ax = fig.gca()
+    self.ax.set_xlabel(xlabel)
+    self.ax.set_ylabel(ylabel)
+    self.ymax_scale = ymax_scale
+    self.step_kwargs = step_kwargs
+    self.steps = None
+
+  def update(self, values, edges, title):
+    """ Show the given histogram.
+    """
+    if self.steps is None:
+      self.steps = self.ax.stairs(values, edges, **self.step_kwargs)
+    else:
+      self.steps.set_data(values, edges)
+
+    self.ax.set_xlim(edges[0], edges[-1])
+    self.ax.set_autoscaley_on(True)
+    self.ax.relim()
+    self.ax.autoscale_view(scalex=False)
+    if self.ymax_scale is not None:
+      self.ax.set_ylim(0, self.ymax_scale*self.ax.get_ylim()[1])
+    self.ax.set_title(title)
+
+# ------------------------------------------------------------------------------
+
+class Projection2DTemplate(FigureTemplate):
+  """ Template of the three 2D projections of a 3D distribution in a corner
+      layout with a common color scale.
+  """
+
+  # Axes indices of the projection shown in each of the panels
+  panel_axes = ((0,1), (0,2), (1,2))
+
+  def __init__(self, axis_labels, colorbar_label, figsize=(12,9)):
+    """ axis_labels ... Labels of the three axes of the distribution
+    """
+    fig, axs = plt.subplots(2, 3, sharex='col', sharey='row', figsize=figsize,
+                            tight_layout=True,
+                            gridspec_kw={'hspace': 0.0, 'wspace': 0.0})
+    super().__init__(fig)
+    (ax1, ax_empty, _1), (ax2, ax3, _2) = axs
+    _1.axis('off')
+    _2.axis('off')
+    ax_empty.axis('off')
+    self.panels = (ax1, ax2, ax3)
+
+    # Draw ticks only on the relevant axes
+    ax1.tick_params(bottom=False, top=True, left=True, right=True,
+                    labelleft=False, labeltop=True, labelright=True)
+    ax2.tick_params(labelbottom=False, labelleft=False)
+    ax3.tick_params(bottom=True, top=True, left=False, right=True,
+                    labeltop=True, labelright=True, labelbottom=False)
+
+    # Create small white lines between the plots
+    for ax_line in (ax2.spines['top'],ax2.spines['right'],ax1.spines['bottom'],
+                    ax3.spines['left']):
+      ax_line.set_linewidth(3)
+      ax_line.set_color('white')
+
+    # Proper labelling of the axes
+    label_args = {"fontsize":30, "ha":'center'}
+    ax1.text(0.5, 1.2, axis_labels[0], transform=ax1.transAxes, **label_args)
+    ax_empty.text(0.5, 0.5, axis_labels[1], transform=ax_empty.transAxes,
+                  **label_args)
+    ax3.text(1.12, 0.65, axis_labels[2], transform=ax3.transAxes, **label_args)
+
+    # Common color scale of all panels, shown in one colorbar
+    self.norm = mcolors.Normalize(0, 1)
+    ax_whole = fig.add_subplot(1,6,5, visible=False)
+    fig.colorbar(mcm.ScalarMappable(norm=self.norm), ax=ax_whole,
+                 label=colorbar_label, fraction=1.0)
+
+    # Process title, text set in update
+    self.title = ax_empty.text(
+      0.5, 1.2, "", transform=ax_empty.transAxes,
+      bbox=dict(facecolor='none', edgecolor='black', boxstyle='round'),
+      **label_args)
+
+    self.meshes = [None] * len(self.panels)
+    self.mesh_edges = [None] * len(self.panels)
+
+  def update(self, projections, edges, title):
+    """ Show the given 2D projections (keyed by the axes indices, see
+        Distribution.projections) on the given edges of each axis.
+    """
+    self.norm.vmax = np.amax([np.amax(projections[axes])
+                              for axes in self.panel_axes])
+
+    for i_panel, (ax, (i, j)) in enumerate(zip(self.panels, self.panel_axes)):
+      values = projections[(i,j)].T
+      mesh_edges = (edges[i], edges[j])
+      if self.meshes[i_panel] is not None and \
+         all(np.array_equal(old, new)
+             for old, new in zip(self.mesh_edges[i_panel], mesh_edges)):
+        # Same binning, only exchange the values
+        self.meshes[i_panel].set_array(values)
+      else:
+        if self.meshes[i_panel] is not None:
+          self.meshes[i_panel].remove()
+        self.meshes[i_panel] = ax.pcolormesh(*mesh_edges, values, norm=self.norm)
+        self.mesh_edges[i_panel] = mesh_edges
+
+    # Useful axis limits
+    ax1, _, ax3 = self.panels
+    ax1.set_xlim((edges[0][0],edges[0][-1]))
+    ax1.set_ylim((edges[1][0],edges[1][-1]))
+    ax3.set_xlim((edges[1][0],edges[1][-1]))
+    ax3.set_ylim((edges[2][0],edges[2][-1]))
+
+    self.title.set_text(title)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,71 @@
+# ------------------------------------------------------------------------------
+
+""" Run per-file work (reading, fitting, plotting) on a pool of processes.
+"""
+
+# ------------------------------------------------------------------------------
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging as log
+import matplotlib
+from multiprocessing.util import Finalize
+import traceback
+from tqdm import tqdm
+
+# Local modules
+import Plotting.DefaultFormat as PDF
+import Plotting.Templates as PT
+
+# ------------------------------------------------------------------------------
+
+def init_worker():
+  """ Prepare a worker process for plotting without display, the figure
+      templates of the worker are released when it shuts down.
+  """
+  matplotlib.use("Agg")
+  PDF.set_default_mpl_format()
+  Finalize(None, PT.release_templates, exitpriority=10)
+
+def run_on_file(func, file_path, args, kwargs):
+  """ Run the function on the file, catching any error.
+      Returns the file path, the result and the formatted error (or None).
+  """
+  try:
+    return file_path, func(file_path, *args, **kwargs), None
+  except Exception:
+    return file_path, None, traceback.format_exc()
+
+# ------------------------------------------------------------------------------
+
+def run_over_files(func, file_paths, *args, n_workers=None, desc="files", 
+                   **kwargs):
+  """ Call func(file_path, *args, **kwargs) for each of the files on a pool of
+      n_workers processes (default: number of CPUs, 1: run in this process).
+      func must be defined at the top level of a module so that it can be sent
+      to the workers.
+      Errors are collected per file instead of aborting the run.
+      Returns a dict with the results and a dict with the error tracebacks, 
+      both keyed by the file path.
+  """
+  results, errors = {}, {}
+  
+  def collect(outcomes):
+    for file_path, result, error in tqdm(outcomes, total=len(file_paths), desc=desc):
+      if error is None:
+        results[file_path] = result
+      else:
+        log.error("Processing {} failed:\n{}".format(file_path, error))
+        errors[file_path] = error
+  
+  if n_workers == 1:
+    collect(run_on_file(func, file_path, args, kwargs) for file_path in file_paths)
+  else:
+    with ProcessPoolExecutor(max_workers=n_workers, 
+                             initializer=init_worker) as executor:
+      futures = [executor.submit(run_on_file, func, file_path, args, kwargs)
+                 for file_path in file_paths]
+      collect(future.result() for future in as_completed(futures))
+  
+  return results, errors
+
+# ------------------------------------------------------------------------------
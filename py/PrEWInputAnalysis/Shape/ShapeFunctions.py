@@ -6,6 +6,17 @@
 
 # ------------------------------------------------------------------------------
 
+# External packages
+import numpy as np
+
+# Local packages
+import Shape.ShapeProperties as SSP
+
+# ------------------------------------------------------------------------------
+
+@SSP.linear
+@SSP.polynomial(lambda A_ss, A_os: [A_ss + A_os, 2*(A_ss - A_os), A_ss + A_os])
+@SSP.gradient(lambda x, A_ss, A_os: [(1+x)**2, (1-x)**2])
 def helicity_amplitudes(x, A_ss, A_os):
   """ Helicity amplitude shape for difermion scattering.
       x ... cos(theta) in difermion rest frame
@@ -14,6 +25,10 @@ def helicity_amplitudes(x, A_ss, A_os):
   """
   return A_ss * (1+x)**2 + A_os * (1-x)**2
 
+@SSP.linear
+@SSP.polynomial(lambda A_ss, A_os, K: [A_ss + A_os + K, 2*(A_ss - A_os), 
+                                       A_ss + A_os - 3*K])
+@SSP.gradient(lambda x, A_ss, A_os, K: [(1+x)**2, (1-x)**2, 1 - 3*x**2])
 def helicity_amplitudes_cor(x, A_ss, A_os, K):
   """ Helicity amplitude shape for difermion scattering including correction 
       term (e.g. for radiative corrections) that leaves integral intact and 
@@ -23,4 +38,79 @@ def helicity_amplitudes_cor(x, A_ss, A_os, K):
       A_os ... opposite-sign amplitude
       K ... correction term factor
   """
-  return A_ss * (1+x)**2 + A_os * (1-x)**2 + K * (1 - 3*x**2)
\ No newline at end of file
+  return A_ss * (1+x)**2 + A_os * (1-x)**2 + K * (1 - 3*x**2)
+
+# ------------------------------------------------------------------------------
+# WW production and decay angles
+#   1D basis functions of the separable WW shape, each with analytic integral.
+
+@SSP.polynomial(lambda: [1])
+def flat(x):
+  return np.ones_like(x)
+
+@SSP.polynomial(lambda: [0, 1])
+def cos_polar(x):
+  return x
+
+@SSP.polynomial(lambda: [0, 0, 1])
+def cos2_polar(x):
+  return x**2
+
+@SSP.antiderivative(lambda x: 0.5 * (x * np.sqrt(np.clip(1 - x**2, 0, None)) 
+                                     + np.arcsin(np.clip(x, -1, 1))))
+def sin_polar(x):
+  return np.sqrt(np.clip(1 - x**2, 0, None))
+
+@SSP.antiderivative(lambda x: -np.clip(1 - x**2, 0, None)**1.5 / 3)
+def sincos_polar(x):
+  return x * np.sqrt(np.clip(1 - x**2, 0, None))
+
+@SSP.polynomial(lambda: [1, 0, -1])
+def sin2_polar(x):
+  return 1 - x**2
+
+@SSP.antiderivative(lambda phi: np.sin(phi))
+def cos_azimuthal(phi):
+  return np.cos(phi)
+
+@SSP.antiderivative(lambda phi: -np.cos(phi))
+def sin_azimuthal(phi):
+  return np.sin(phi)
+
+@SSP.antiderivative(lambda phi: 0.5 * np.sin(2*phi))
+def cos2_azimuthal(phi):
+  return np.cos(2*phi)
+
+@SSP.antiderivative(lambda phi: -0.5 * np.cos(2*phi))
+def sin2_azimuthal(phi):
+  return np.sin(2*phi)
+
+# Functions of (cos(theta*), phi*) spanned by the decay of a spin-1 particle
+# with any spin density matrix (spherical harmonics up to L=2)
+spin1_decay_terms = [
+  (flat, flat), (cos_polar, flat), (cos2_polar, flat),
+  (sin_polar, cos_azimuthal), (sin_polar, sin_azimuthal),
+  (sincos_polar, cos_azimuthal), (sincos_polar, sin_azimuthal),
+  (sin2_polar, cos2_azimuthal), (sin2_polar, sin2_azimuthal) ]
+
+def legendre(order):
+  """ Legendre polynomial of the given order as (polynomial) shape function.
+  """
+  coefs = np.polynomial.legendre.leg2poly(np.eye(order+1)[order])
+  @SSP.polynomial(lambda: coefs)
+  def legendre_polynomial(x):
+    return np.polynomial.polynomial.polyval(x, coefs)
+  return legendre_polynomial
+
+def WW_angular_shape(max_order_W=4):
+  """ Create the separable linear shape of the WW production and decay angles:
+      a Legendre series up to max_order_W in the production angle for each of
+      the spin-1 decay functions of the lepton angles (spin1_decay_terms).
+      The shape takes x = (cos(theta_W), cos(theta*_l), phi*_l) and has 
+      (max_order_W+1)*9 coefficients, the production order running slowest.
+  """
+  terms = [(legendre(order),) + decay 
+           for order in range(max_order_W+1) for decay in spin1_decay_terms]
+  shape = SSP.separable_combination(*terms)
+  shape.__name__ = "WW_angular_shape"
+  return shape
@@ -0,0 +1,154 @@
+# ------------------------------------------------------------------------------
+
+""" Decorators that attach analytic properties to shape functions.
+    The bin integration in ShapeTesting uses these properties (if available)
+    instead of numerical integration.
+"""
+
+# ------------------------------------------------------------------------------
+
+import inspect
+import numpy as np
+
+# ------------------------------------------------------------------------------
+# Declaring properties
+
+def antiderivative(prim):
+  """ Declare an analytic antiderivative prim(x, *args) of the shape function.
+      prim must accept arrays of x values.
+  """
+  def decorator(func):
+    func.antiderivative = prim
+    return func
+  return decorator
+
+def polynomial(coefficients):
+  """ Declare the shape function as a polynomial in x.
+      coefficients(*args) ... returns the polynomial coefficients for the
+                              given parameters in increasing order of x powers
+  """
+  def decorator(func):
+    func.polynomial = coefficients
+    return func
+  return decorator
+
+def gradient(grad):
+  """ Declare the gradient of the shape function w.r.t. its parameters.
+      grad(x, *args) ... returns the sequence of partial derivatives (one per 
+                         parameter), each evaluated at x
+  """
+  def decorator(func):
+    func.gradient = grad
+    return func
+  return decorator
+
+def linear(func):
+  """ Declare the shape function as linear in its parameters.
+  """
+  func.linear = True
+  return func
+
+def linear_combination(*basis):
+  """ Create a shape function f(x, *coefs) = sum_j coefs[j] * basis[j](x) from
+      the given basis functions. The result is declared linear and has an 
+      analytic antiderivative if all basis functions have one.
+  """
+  def combination(x, *coefs):
+    return sum(c * b(x) for c, b in zip(coefs, basis))
+  combination.__name__ = "linear_combination"
+  combination.__signature__ = inspect.Signature(
+    [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD) 
+     for name in ["x"] + ["c{}".format(j) for j in range(len(basis))]])
+  if all(has_analytic_integral(b) for b in basis):
+    prims = [primitive(b) for b in basis]
+    combination.antiderivative = \
+      lambda x, *coefs: sum(c * prim(x) for c, prim in zip(coefs, prims))
+  return linear(combination)
+
+def separable_combination(*terms):
+  """ Create an N-dimensional shape function 
+        f(x, *coefs) = sum_k coefs[k] * prod_d terms[k][d](x[d])
+      where each term is a sequence of 1D basis functions, one per axis, and
+      x[d] are the coordinates on axis d.
+      The result is declared linear and its bin integrals factorise into 1D 
+      integrals if all basis functions have an analytic integral.
+  """
+  def combination(x, *coefs):
+    return sum(c * np.prod([b(x_d) for b, x_d in zip(term, x)], axis=0) 
+               for c, term in zip(coefs, terms))
+  combination.__name__ = "separable_combination"
+  combination.__signature__ = inspect.Signature(
+    [inspect.Parameter(name, inspect.Parameter.POSITIONAL_OR_KEYWORD) 
+     for name in ["x"] + ["c{}".format(k) for k in range(len(terms))]])
+  if all(has_analytic_integral(b) for term in terms for b in term):
+    combination.separable = [[primitive(b) for b in term] for term in terms]
+  return linear(combination)
+
+# ------------------------------------------------------------------------------
+# Using properties
+
+def has_analytic_integral(func):
+  """ Check whether the bin integral of the function is known analytically.
+  """
+  return hasattr(func, "polynomial") or hasattr(func, "antiderivative")
+
+def has_gradient(func):
+  """ Check whether the parameter gradient of the function is known.
+  """
+  return hasattr(func, "gradient")
+
+def gradient_values(func, x, *args):
+  """ Evaluate the declared gradient at x, as array of shape 
+      (n_params, *x.shape).
+  """
+  x = np.asarray(x, dtype=float)
+  return np.array([np.broadcast_to(g, x.shape) for g in func.gradient(x, *args)],
+                  dtype=float)
+
+def is_declared_linear(func):
+  """ Check whether the function is declared linear in its parameters.
+  """
+  return getattr(func, "linear", False)
+
+def primitive(func):
+  """ Return the analytic antiderivative prim(x, *args) of the function.
+  """
+  if hasattr(func, "antiderivative"):
+    return func.antiderivative
+  elif hasattr(func, "polynomial"):
+    return lambda x, *args: np.polynomial.polynomial.polyval(
+      x, np.polynomial.polynomial.polyint(func.polynomial(*args)))
+  else:
+    raise ValueError("No analytic integral known for {}".format(func.__name__))
+
+def polynomial_bin_matrix(edges_min, edges_max, n_coefs):
+  """ Matrix M with the integral of x^k in each bin, such that M @ coefs gives
+      the bin integrals of the polynomial with the given coefficients.
+  """
+  k = np.arange(1, n_coefs+1)
+  return (np.power.outer(edges_max, k) - np.power.outer(edges_min, k)) / k
+
+def analytic_bin_integral(func, edges_min, edges_max, *args):
+  """ Calculate the bin integrals of the function from its analytic properties.
+  """
+  if hasattr(func, "polynomial"):
+    coefs = np.asarray(func.polynomial(*args), dtype=float)
+    return polynomial_bin_matrix(edges_min, edges_max, len(coefs)) @ coefs
+  elif hasattr(func, "antiderivative"):
+    prim = func.antiderivative
+    return prim(edges_max, *args) - prim(edges_min, *args)
+  else:
+    raise ValueError("No analytic integral known for {}".format(func.__name__))
+
+def separable_bin_matrix(func, lower, upper):
+  """ Matrix M (n_bins x n_terms) with the integral of each separable term
+      (see separable_combination) over each hyper-rectangular bin, such that 
+      M @ coefs gives the bin integrals.
+      lower, upper ... (n_bins x n_dims) lower and upper bin edges
+  """
+  return np.column_stack([
+    np.prod([prim(upper[:,d]) - prim(lower[:,d]) for d, prim in enumerate(prims)], 
+            axis=0)
+    for prims in func.separable ])
+
+# ------------------------------------------------------------------------------
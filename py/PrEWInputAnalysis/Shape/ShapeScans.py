@@ -0,0 +1,243 @@
+# ------------------------------------------------------------------------------
+
+""" Scans of the chi-squared or Poisson deviance over 1D and 2D grids of
+    parameters, with the remaining (nuisance) parameters profiled. The whole
+    grid is evaluated in vectorized batches on the bin-integrated basis of the
+    shape functions.
+"""
+
+# ------------------------------------------------------------------------------
+
+import itertools
+import numpy as np
+import scipy.stats as stats
+
+# Local modules
+import Shape.ShapeProperties as SSP
+import Shape.ShapeTesting as SST
+
+# ------------------------------------------------------------------------------
+# Batched model evaluation
+
+def batch_bin_integral(func, x, n_params, method="auto", n_nodes=8):
+  """ Create a function that returns the bin integrals of the function for a
+      batch of parameter vectors (n_points x n_params) as (n_points x n_bins)
+      array. The bin-integrated basis is precomputed:
+      Linear functions (declared or checked numerically, see
+      ShapeTesting.linear_design) use the design matrix, polynomial ones (see
+      ShapeProperties.polynomial) the bin integrals of the monomials and all
+      others a Gauss-Legendre grid with n_nodes nodes per bin.
+  """
+  design = SST.linear_design(func, x, n_params, method, n_nodes, linear="check")
+  if design is not None:
+    return lambda P: P @ design.T
+
+  if hasattr(func, "polynomial"):
+    n_coefs = len(func.polynomial(*np.ones(n_params)))
+    basis = SSP.polynomial_bin_matrix(x[:,0], x[:,1], n_coefs)
+    def poly_integral(P):
+      coefs = np.broadcast_arrays(*func.polynomial(*P.T), np.empty(len(P)))[:-1]
+      return np.stack(coefs, axis=1) @ basis.T
+    return poly_integral
+
+  nodes, weights = SST.gauss_legendre_grid(x, n_nodes)
+  def gauss_integral(P):
+    args = [p[:,np.newaxis,np.newaxis] for p in P.T]
+    return np.sum(weights * func(nodes[np.newaxis], *args), axis=2)
+  return gauss_integral
+
+class ScanModel:
+  """ Class evaluating the bin-integrated model of one or several channels
+      (with shared parameters, see ShapeTesting.FitChannel) for batches of
+      global parameter vectors.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, channels, method="auto", n_nodes=8):
+    self.par_names = SST.simultaneous_parameters(channels)
+    self.bin_vals = np.concatenate([channel.bin_vals for channel in channels])
+    self.parts = [
+      ([self.par_names.index(par) for par in channel.parameters],
+       batch_bin_integral(channel.func, channel.x, len(channel.parameters),
+                          method, n_nodes))
+      for channel in channels ]
+
+  # --- Access functions -------------------------------------------------------
+
+  def __call__(self, P):
+    """ Bin integrals (n_points x n_bins) for the parameters (n_points x n_params).
+    """
+    return np.concatenate([evaluate(P[:,i_par]) for i_par, evaluate in self.parts],
+                          axis=1)
+
+  def jacobian(self, P, i_pars):
+    """ Central difference derivatives (n_points x n_bins x len(i_pars)) of the
+        bin integrals w.r.t. the given parameters.
+    """
+    J = []
+    for i in i_pars:
+      step = 1e-6 * np.maximum(np.abs(P[:,i]), 1.0)
+      P_up, P_down = P.copy(), P.copy()
+      P_up[:,i] += step
+      P_down[:,i] -= step
+      J.append((self(P_up) - self(P_down)) / (2 * step[:,np.newaxis]))
+    return np.stack(J, axis=2)
+
+# ------------------------------------------------------------------------------
+# Profiling
+
+def cost_values(bin_vals, fit_vals, cost):
+  """ Chi-squared (see ShapeTesting.chi_squared) or Poisson deviance (see
+      ShapeTesting.poisson_deviance) of each row of fit values.
+  """
+  if cost == "chi2":
+    return SST.chi_squared(bin_vals, fit_vals)
+  elif cost == "poisson":
+    return SST.poisson_deviance(bin_vals, fit_vals)
+  raise ValueError("Unknown cost {}".format(cost))
+
+def profile(model, P, i_nuis, cost="chi2", max_iter=50, rtol=1e-10):
+  """ Minimise the cost w.r.t. the nuisance parameters (indices i_nuis) for a
+      batch of parameter vectors P (nuisance entries are the starting values)
+      with damped Gauss-Newton (chi2) or Fisher scoring (poisson) steps that
+      are taken for all points at once.
+      Returns the profiled parameters and the cost values.
+  """
+  P = np.array(P, dtype=float)
+  y = model.bin_vals
+  values = cost_values(y, model(P), cost)
+  if len(i_nuis) == 0:
+    return P, values
+
+  for _ in range(max_iter):
+    mu = model(P)
+    J = model.jacobian(P, i_nuis)
+    if cost == "chi2":
+      weights = 1.0 / y
+      grad = np.einsum('nbk,b,nb->nk', J, weights, mu - y)
+      hess = np.einsum('nbk,b,nbl->nkl', J, weights, J)
+    else:
+      mu = np.maximum(mu, np.finfo(float).tiny)
+      grad = np.einsum('nbk,nb->nk', J, 1.0 - y / mu)
+      hess = np.einsum('nbk,nb,nbl->nkl', J, 1.0 / mu, J)
+    step = np.einsum('nkl,nl->nk', np.linalg.pinv(hess), grad)
+
+    # Halve the step of each point until its cost does not increase
+    scale = np.ones(len(P))
+    for _ in range(30):
+      P_new = P.copy()
+      P_new[:,i_nuis] -= scale[:,np.newaxis] * step
+      with np.errstate(all='ignore'):
+        new_values = cost_values(y, model(P_new), cost)
+      worse = ~(new_values <= values)
+      if not np.any(worse):
+        break
+      scale[worse] /= 2
+    new_values[worse] = values[worse]
+    P_new[worse] = P[worse]
+
+    improvement = np.max(values - new_values)
+    P, values = P_new, new_values
+    if improvement <= rtol * np.max(np.abs(values)):
+      break
+
+  return P, values
+
+# ------------------------------------------------------------------------------
+# Scans
+
+def scan_channels(channels, scan_pars, p0=None, cost="chi2", method="auto",
+                  n_nodes=8, batch_size=4096, max_iter=50):
+  """ Scan the cost of a (simultaneous) fit of the channels over a grid of the
+      given parameters, profiling all other parameters.
+      scan_pars ... dict from parameter name to its 1D array of grid values,
+                    usually one or two parameters
+      p0 ... Global parameters at which profiling starts (default: best fit
+             with ShapeTesting.fit_simultaneous using the same cost, so that 
+             distributions with empty bins can be scanned with the Poisson
+             deviance)
+      batch_size ... Grid points profiled at once
+      Returns a ScanResult.
+  """
+  model = ScanModel(channels, method, n_nodes)
+  if p0 is None:
+    p0 = SST.fit_simultaneous(channels, method=method, n_nodes=n_nodes, 
+                              cost=cost)[1]
+  p0 = np.asarray(p0, dtype=float)
+
+  names = list(scan_pars)
+  grids = [np.asarray(scan_pars[name], dtype=float) for name in names]
+  i_scan = [model.par_names.index(name) for name in names]
+  i_nuis = [i for i in range(len(p0)) if i not in i_scan]
+
+  # Global minimum by profiling all parameters from the start point
+  best, best_value = profile(model, p0[np.newaxis], list(range(len(p0))), cost,
+                             max_iter)
+
+  points = np.array(list(itertools.product(*grids))).reshape(-1, len(grids))
+  P = np.tile(best, (len(points), 1))
+  P[:,i_scan] = points
+  values = np.empty(len(points))
+  for start in range(0, len(points), batch_size):
+    batch = slice(start, start + batch_size)
+    P[batch], values[batch] = profile(model, P[batch], i_nuis, cost, max_iter)
+
+  shape = tuple(len(grid) for grid in grids)
+  return ScanResult(names, grids, values.reshape(shape),
+                    P.reshape(shape + (len(p0),)), model.par_names, best[0],
+                    min(best_value[0], np.min(values)))
+
+def scan_function(func, bin_vals, edges_min, edges_max, scan_pars, **kwargs):
+  """ Scan the cost of a fit of the function to one distribution, see
+      scan_channels for the arguments.
+  """
+  channel = SST.FitChannel(func.__name__, func, bin_vals, edges_min, edges_max)
+  return scan_channels([channel], scan_pars, **kwargs)
+
+# ------------------------------------------------------------------------------
+
+class ScanResult:
+  """ Class holding the cost on a parameter grid, with the profiled parameters
+      at each grid point.
+      Contours can be drawn directly, e.g. for a 2D scan:
+        ax.contour(*result.grids, result.delta().T, levels=result.levels())
+  """
+
+  def __init__(self, names, grids, values, profiled, par_names, best, min_value):
+    """ names, grids ... Scanned parameters and their grid values
+        values ... Cost at each grid point (shape of the grid)
+        profiled ... All global parameters at each grid point
+        par_names, best ... Global parameter names and their best fit values
+        min_value ... Cost at the global minimum
+    """
+    self.names = names
+    self.grids = grids
+    self.values = values
+    self.profiled = profiled
+    self.par_names = par_names
+    self.best = best
+    self.min_value = min_value
+
+  def delta(self):
+    """ Cost difference to the global minimum at each grid point.
+    """
+    return self.values - self.min_value
+
+  def levels(self, confidence_levels=(0.6827, 0.9545)):
+    """ Cost differences of the given confidence levels for the number of
+        scanned parameters (Wilks' theorem).
+    """
+    return stats.chi2.ppf(confidence_levels, len(self.names))
+
+  def mesh(self):
+    """ Grid values of each scanned parameter at each grid point.
+    """
+    return np.meshgrid(*self.grids, indexing='ij')
+
+  def profiled_parameter(self, name):
+    """ Profiled values of the given parameter at each grid point.
+    """
+    return self.profiled[..., self.par_names.index(name)]
+
+# ------------------------------------------------------------------------------
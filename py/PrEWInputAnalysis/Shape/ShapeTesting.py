@@ -7,44 +7,901 @@
 # ------------------------------------------------------------------------------
 
 # External packages
+from concurrent.futures import ProcessPoolExecutor
 import functools
+import inspect
+import logging as log
 import numpy as np
 import scipy.integrate as integrate
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, linprog, lsq_linear, nnls
+import scipy.stats as stats
 import sys
 
 # Local packages
-import FuncHelp.Wrappers as FHW
+import Shape.ShapeProperties as SSP
 
 # ------------------------------------------------------------------------------
 
-def bin_integral_1D(func):
+@functools.lru_cache(maxsize=32)
+def _cached_gauss_legendre_grid(edges_bytes, n_nodes):
+  """ Cached calculation of the Gauss-Legendre grid for the byte 
+      representation of an edge array.
+  """
+  x = np.frombuffer(edges_bytes, dtype=float).reshape(-1,2)
+  ref_nodes, ref_weights = np.polynomial.legendre.leggauss(n_nodes)
+  half_widths = 0.5 * (x[:,1] - x[:,0])
+  centers = 0.5 * (x[:,1] + x[:,0])
+  nodes = centers[:,np.newaxis] + np.outer(half_widths, ref_nodes)
+  weights = np.outer(half_widths, ref_weights)
+  nodes.flags.writeable = False
+  weights.flags.writeable = False
+  return nodes, weights
+
+def gauss_legendre_grid(x, n_nodes):
+  """ Return the (n_bins x n_nodes) arrays of Gauss-Legendre nodes and weights
+      for the bins with edges x (lower edges in first, upper in second column).
+      The grid is cached per edge array.
+  """
+  x = np.ascontiguousarray(x, dtype=float)
+  return _cached_gauss_legendre_grid(x.tobytes(), n_nodes)
+
+# ------------------------------------------------------------------------------
+
+def bin_integral_1D(func, method="auto", n_nodes=8):
+  """ Create a function that returns the integral of the given function in each
+      bin.
+      method ... "auto": analytic integral if the function declares one (see 
+                         ShapeProperties), otherwise quad
+                 "analytic": analytic integral
+                 "gauss": fixed-order Gauss-Legendre quadrature with n_nodes 
+                          nodes per bin, function must accept array input
+                 "quad": adaptive integration per bin
+  """
+  if method == "auto":
+    method = "analytic" if SSP.has_analytic_integral(func) else "quad"
+  if method not in ("analytic", "gauss", "quad"):
+    raise ValueError("Unknown integration method {}".format(method))
+  
   @functools.wraps(func)
   def wrapper_bin_integrated(x, *args):
     """ Return the integral of the given function in each bin.
     """
+    if method == "analytic":
+      return SSP.analytic_bin_integral(func, x[:,0], x[:,1], *args)
+    elif method == "gauss":
+      nodes, weights = gauss_legendre_grid(x, n_nodes)
+      return np.sum(weights * func(nodes, *args), axis=1)
     f = lambda _x: func(_x, *args)
     return np.array([integrate.quad(f, x[b][0], x[b][1])[0] for b in range(len(x))])
   return wrapper_bin_integrated
 
+def bin_integral_jac_1D(func, method="auto", n_nodes=8):
+  """ Create a function that returns the integral of the parameter gradient 
+      of the given function in each bin, as (n_bins x n_params) array.
+      Requires a gradient declared via ShapeProperties.gradient.
+      method ... Same as in bin_integral_1D, "analytic" uses Gauss-Legendre
+                 quadrature of exact order for polynomials and quad otherwise
+  """
+  if method == "auto":
+    method = "analytic" if SSP.has_analytic_integral(func) else "quad"
+  if method not in ("analytic", "gauss", "quad"):
+    raise ValueError("Unknown integration method {}".format(method))
+  
+  def jac_bin_integrated(x, *args):
+    """ Return the integral of the parameter gradient in each bin.
+    """
+    grad_method, grad_nodes = method, n_nodes
+    if method == "analytic":
+      if hasattr(func, "polynomial"):
+        grad_method, grad_nodes = "gauss", len(func.polynomial(*args)) // 2 + 1
+      else:
+        grad_method = "quad"
+    
+    if grad_method == "gauss":
+      nodes, weights = gauss_legendre_grid(x, grad_nodes)
+      return np.einsum('bn,kbn->bk', weights, SSP.gradient_values(func, nodes, *args))
+    g = lambda _x, j: func.gradient(_x, *args)[j]
+    return np.array([[integrate.quad(g, x[b][0], x[b][1], args=(j,))[0] 
+                      for j in range(len(args))] for b in range(len(x))])
+  return jac_bin_integrated
+
+def quad_deviation(func, x, *args, method="gauss", n_nodes=8):
+  """ Maximum relative deviation of the bin integrals with the given method 
+      from the bin integrals calculated with quad.
+  """
+  approx = bin_integral_1D(func, method, n_nodes)(x, *args)
+  exact = bin_integral_1D(func, "quad")(x, *args)
+  return np.max(np.abs(approx - exact) / np.maximum(np.abs(exact), np.finfo(float).tiny))
+
+# ------------------------------------------------------------------------------
+
+def n_parameters(func, p0=None):
+  """ Number of fit parameters of the function (all arguments after x, unless
+      the starting values p0 are given).
+  """
+  if p0 is not None:
+    return len(p0)
+  return len(inspect.signature(func).parameters) - 1
+
+def linear_design_matrix(func, x, n_params, method="auto", n_nodes=8, 
+                         integral=bin_integral_1D):
+  """ Bin integrals of the function for each unit parameter vector.
+      For a linear model the bin integrals are then design_matrix @ p.
+      integral ... Bin integration (bin_integral_1D or bin_integral_ND)
+  """
+  if integral is bin_integral_ND and hasattr(func, "separable") and \
+     method in ("auto", "separable"):
+    return SSP.separable_bin_matrix(func, x[:,0], x[:,1])
+  f = integral(func, method, n_nodes)
+  with np.errstate(all='ignore'):
+    return np.column_stack([f(x, *unit) for unit in np.eye(n_params)])
+
+def linear_design(func, x, n_params, method="auto", n_nodes=8, linear=None,
+                  integral=bin_integral_1D):
+  """ Design matrix (see linear_design_matrix) if the function is treated as
+      linear in its parameters, otherwise None.
+      linear ... True/False: treat the function as (not) linear
+                 None: linear if declared (see ShapeProperties)
+                 "check": linear if declared or if is_linear confirms it 
+                          numerically (costs n_params+1 extra evaluations of
+                          the bin integrals, opt-in for expensive models)
+  """
+  if linear is False or \
+     (linear is None and not SSP.is_declared_linear(func)):
+    return None
+  if linear == "check" and not SSP.is_declared_linear(func):
+    try:
+      design = linear_design_matrix(func, x, n_params, method, n_nodes, integral)
+    except (ArithmeticError, ValueError):
+      return None
+    return design if is_linear(func, x, design, method, n_nodes, integral) else None
+  return linear_design_matrix(func, x, n_params, method, n_nodes, integral)
+
+def is_linear(func, x, design, method="auto", n_nodes=8, 
+              integral=bin_integral_1D):
+  """ Check numerically whether the bin-integrated function is linear in its 
+      parameters, using the design matrix from linear_design_matrix.
+  """
+  probe = np.random.default_rng(1).uniform(0.5, 1.5, design.shape[1])
+  with np.errstate(all='ignore'):
+    try:
+      probed = integral(func, method, n_nodes)(x, *probe)
+    except (ArithmeticError, ValueError):
+      return False
+    expected = design @ probe
+  if not (np.all(np.isfinite(probed)) and np.all(np.isfinite(design))):
+    return False
+  return np.allclose(probed, expected, rtol=1e-9, atol=1e-12*np.max(np.abs(expected)))
+
+def linear_least_squares(design, bin_vals, yerr, bounds=(-np.inf,np.inf)):
+  """ Solve the weighted least squares problem of a linear model directly.
+      Uses NNLS for non-negativity bounds and bounded-variable least squares 
+      for other bounds.
+      Returns the parameters and their covariance (scaled like in curve_fit).
+  """
+  n_bins, n_params = design.shape
+  lower, upper = [np.broadcast_to(np.asarray(b, dtype=float), (n_params,)) 
+                  for b in bounds]
+  A = design / yerr[:,np.newaxis]
+  y = bin_vals / yerr
+  
+  if np.all(np.isneginf(lower)) and np.all(np.isposinf(upper)):
+    p = np.linalg.lstsq(A, y, rcond=None)[0]
+  elif np.all(lower == 0) and np.all(np.isposinf(upper)):
+    p = nnls(A, y)[0]
+  else:
+    p = lsq_linear(A, y, bounds=(lower, upper), method='bvls').x
+  
+  # Same covariance convention as curve_fit (absolute_sigma=False)
+  n_dof = n_bins - n_params
+  cov = np.linalg.pinv(A.T @ A)
+  if n_dof > 0:
+    cov *= np.sum((y - A @ p)**2) / n_dof
+  else:
+    cov.fill(np.inf)
+  
+  return p, cov
+
 # ------------------------------------------------------------------------------
 
-def fit_1D(func, bin_vals, edges_min, edges_max, p0=None, bounds=(-np.inf,np.inf)):
+def fit_1D(func, bin_vals, edges_min, edges_max, p0=None, bounds=(-np.inf,np.inf),
+           method="auto", n_nodes=8, check_rtol=None, linear=None, cost="chi2"):
   """ Fit the given function to the provided values (which are the integral in 
       each bin).
+      cost ... "chi2": least squares with Gaussian errors sqrt(bin_vals)
+               "poisson": binned Poisson likelihood, see fit_1D_poisson
+      method, n_nodes ... Integration method, see bin_integral_1D
+      check_rtol ... If given, compare the bin integrals at the fit result to 
+                     quad and warn if they deviate more than this
+      linear ... Whether the function is linear in its parameters, in which 
+                 case the least squares problem is solved directly.
+                 If None, use the declaration of the function (see 
+                 ShapeProperties), "check" also checks it numerically (see 
+                 linear_design).
+                 An explicit basis can be used via 
+                 ShapeProperties.linear_combination.
+      Non-linear fits use the bin-integrated gradient as Jacobian if the 
+      function declares one (see ShapeProperties.gradient).
+  """
+  if cost == "poisson":
+    fit_y, p, cov = fit_1D_poisson(func, bin_vals, edges_min, edges_max, p0, 
+                                   bounds, method, n_nodes, linear)
+  elif cost == "chi2":
+    fit_y, p, cov = fit_1D_chi2(func, bin_vals, edges_min, edges_max, p0, 
+                                bounds, method, n_nodes, linear)
+  else:
+    raise ValueError("Unknown cost {}".format(cost))
+  
+  if check_rtol is not None:
+    x = np.column_stack((edges_min, edges_max))
+    deviation = quad_deviation(func, x, *p, method=method, n_nodes=n_nodes)
+    if deviation > check_rtol:
+      log.warning("Bin integrals of {} deviate from quad by {} (> {})".format(
+                  func.__name__, deviation, check_rtol))
+  
+  return fit_y, p, cov
+
+def fit_1D_chi2(func, bin_vals, edges_min, edges_max, p0=None, 
+                bounds=(-np.inf,np.inf), method="auto", n_nodes=8, linear=None):
+  """ Least squares fit of fit_1D (Gaussian errors sqrt(bin_vals)).
   """
   x = np.column_stack((edges_min, edges_max)) # x ... Edges
+  return fit_binned(func, x, bin_vals, p0, bounds, method, n_nodes, linear, 
+                    "chi2")
+
+def fit_binned(func, x, bin_vals, p0=None, bounds=(-np.inf,np.inf), 
+               method="auto", n_nodes=8, linear=None, cost="chi2", 
+               integral=bin_integral_1D):
+  """ Fit of the bin-integrated function to the bin values, shared by the 1D
+      and N-dimensional fits.
+      x ... Bin edges as expected by the integration
+      integral ... Bin integration (bin_integral_1D or bin_integral_ND)
+      Linear models are fitted via their design matrix (see linear_design), 
+      the least squares solution directly and the Poisson likelihood starting
+      from a physical point near it (see feasible_start).
+      Non-linear models use the bin-integrated gradient if the 1D function 
+      declares one, finite differences otherwise.
+      Returns the fit values, parameters and covariance.
+  """
+  bin_vals = np.asarray(bin_vals, dtype=float)
+  n_params = n_parameters(func, p0)
+  design = linear_design(func, x, n_params, method, n_nodes, linear, integral)
+  
+  if design is not None:
+    model = lambda p: design @ p
+  else:
+    f = integral(func, method, n_nodes)
+    model = lambda p: f(x, *p)
+    jac = None
+    if integral is bin_integral_1D and SSP.has_gradient(func):
+      jac = bin_integral_jac_1D(func, method, n_nodes)
+  
+  if cost == "poisson":
+    if design is not None:
+      model_jac = lambda p: design
+      p0 = feasible_start(design, bin_vals, p0, bounds)
+    else:
+      if jac is not None:
+        model_jac = lambda p: jac(x, *p)
+      else:
+        model_jac = lambda p: numerical_jacobian(model, p)
+      if p0 is None:
+        p0 = np.ones(n_params)
+    return poisson_minimize(model, model_jac, bin_vals, p0, bounds, func.__name__)
+  elif cost != "chi2":
+    raise ValueError("Unknown cost {}".format(cost))
+  
   yerr = np.sqrt(bin_vals) # Gaussian error
-  f = bin_integral_1D(func)
-  p, cov = curve_fit(f=f, xdata=x, ydata=bin_vals, sigma=yerr, p0=p0, bounds=bounds)
-  fit_y = FHW.array_arg_wrapper(f,[x, *p]) 
+  if design is not None:
+    p, cov = linear_least_squares(design, bin_vals, yerr, bounds)
+  else:
+    p, cov = curve_fit(f=f, xdata=x, ydata=bin_vals, sigma=yerr, p0=p0, 
+                       bounds=bounds, jac=jac)
+  
+  return model(p), p, cov
+
+# ------------------------------------------------------------------------------
+# Binned Poisson likelihood
+
+def poisson_nll(bin_vals, fit_vals):
+  """ Binned Poisson negative log-likelihood of the fit values (without the 
+      constant log(n!) terms, using the last axis as bins).
+  """
+  fit_vals = np.maximum(fit_vals, np.finfo(float).tiny)
+  return np.sum(fit_vals - bin_vals * np.log(fit_vals), axis=-1)
+
+def poisson_deviance(bin_vals, fit_vals):
+  """ Likelihood ratio -2 ln(L_fit / L_saturated) of the fit w.r.t. a perfect
+      description of the bin values (using the last axis as bins).
+      Asymptotically chi^2 distributed, but unlike chi_squared also defined 
+      for empty bins.
+  """
+  fit_vals = np.maximum(fit_vals, np.finfo(float).tiny)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    log_terms = np.where(bin_vals > 0, bin_vals * np.log(bin_vals / fit_vals), 0.0)
+  return 2.0 * np.sum(fit_vals - bin_vals + log_terms, axis=-1)
+
+def likelihood_ratio_gof(bin_vals, fit_vals, n_params):
+  """ Likelihood ratio goodness of fit: deviance per degree of freedom and the
+      p-value of the deviance.
+  """
+  n_dof = np.shape(bin_vals)[-1] - n_params
+  deviance = poisson_deviance(bin_vals, fit_vals)
+  return deviance / n_dof, stats.chi2.sf(deviance, n_dof)
+
+def numerical_jacobian(model, p):
+  """ Forward difference Jacobian (n_bins x n_params) of the model at p.
+  """
+  f0 = model(p)
+  steps = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(p), 1.0)
+  return np.column_stack([(model(p + step * unit) - f0) / step 
+                          for step, unit in zip(steps, np.eye(len(p)))])
+
+def fit_1D_poisson(func, bin_vals, edges_min, edges_max, p0=None, 
+                   bounds=(-np.inf,np.inf), method="auto", n_nodes=8, 
+                   linear=None):
+  """ Fit the function to the bin counts by minimising the binned Poisson 
+      negative log-likelihood (valid also for sparsely populated and empty 
+      bins). Arguments as in fit_1D.
+      The expectations are kept positive in all bins (see poisson_minimize).
+      Linear (incl. polynomial) models are evaluated as design matrix product
+      with exact gradient and start from the least squares solution (see 
+      feasible_start), other models use the bin-integrated gradient if 
+      declared and need start values with positive expectations.
+      The covariance is the inverse Fisher information at the minimum.
+      Returns the fit values, parameters and covariance.
+  """
+  x = np.column_stack((edges_min, edges_max)) # x ... Edges
+  return fit_binned(func, x, bin_vals, p0, bounds, method, n_nodes, linear, 
+                    "poisson")
+
+def is_physical(design, p, lower, upper):
+  """ Check whether the parameters are strictly inside the bounds and give 
+      positive expectations (design @ p) in all bins.
+  """
+  return np.all(p > lower) and np.all(p < upper) and np.all(design @ p > 0)
+
+def feasible_start(design, bin_vals, p0=None, bounds=(-np.inf,np.inf)):
+  """ Starting values of a Poisson fit of a linear model (expectations 
+      design @ p) that are strictly inside the bounds and give positive 
+      expectations in all bins: p0 (default: least squares solution), moved 
+      towards the most central such point (found by linear programming) if 
+      needed.
+      Raises a ValueError if no parameters give positive expectations.
+  """
+  n_params = design.shape[1]
+  lower, upper = [np.broadcast_to(np.asarray(b, dtype=float), (n_params,)) 
+                  for b in bounds]
+  if p0 is None:
+    # Errors of at least one count also work for empty bins
+    p0 = linear_least_squares(design, bin_vals, 
+                              np.sqrt(np.maximum(bin_vals, 1.0)), bounds)[0]
+  p0 = np.clip(np.asarray(p0, dtype=float), lower, upper)
+  if is_physical(design, p0, lower, upper):
+    return p0
+  
+  # Maximise the margin s to all bin expectations (in units of the mean count)
+  # and finite bounds (in units of the parameter scale)
+  count_scale = max(np.mean(bin_vals), 1.0)
+  par_scale = np.where(np.abs(p0) > 0, np.abs(p0), 1.0)
+  has_lower, has_upper = np.isfinite(lower), np.isfinite(upper)
+  unit = np.eye(n_params)
+  A_ub = np.vstack((
+    np.column_stack((-design, np.full(len(design), count_scale))),
+    np.column_stack((-unit[has_lower], par_scale[has_lower])),
+    np.column_stack((unit[has_upper], par_scale[has_upper])) ))
+  b_ub = np.concatenate((np.zeros(len(design)), -lower[has_lower], 
+                         upper[has_upper]))
+  result = linprog(np.append(np.zeros(n_params), -1.0), A_ub=A_ub, b_ub=b_ub,
+                   bounds=[(None, None)] * n_params + [(None, 1.0)], 
+                   method="highs")
+  if result.status != 0 or result.x[-1] <= 0:
+    raise ValueError("No parameters inside the bounds give positive "
+                     "expectations in all bins")
+  central = result.x[:-1]
+  
+  # Closest physical point to p0 on the line towards the central point
+  fraction = 1.0
+  for _ in range(60):
+    p = central + fraction * (p0 - central)
+    if is_physical(design, p, lower, upper):
+      return p
+    fraction /= 2
+  return central
+
+def poisson_minimize(model, model_jac, bin_vals, p0, bounds=(-np.inf,np.inf),
+                     name="model", max_iter=100):
+  """ Minimise the binned Poisson negative log-likelihood of the model (bin 
+      expectations model(p) with Jacobian model_jac(p)), starting from p0 
+      strictly inside the bounds with positive expectations in all bins (e.g.
+      from feasible_start).
+      Damped Newton steps (Gauss-Newton for non-linear models) never leave 
+      this physical region. Minima on its boundary (vanishing expectations in
+      empty bins, parameters at their bounds) are reached with a logarithmic 
+      barrier that is reduced until it is negligible (interior point method).
+      Returns the fit values, parameters and covariance (inverse Fisher 
+      information at the minimum).
+  """
+  bin_vals = np.asarray(bin_vals, dtype=float)
+  p = np.asarray(p0, dtype=float)
+  lower, upper = [np.broadcast_to(np.asarray(b, dtype=float), (len(p),)) 
+                  for b in bounds]
+  if not (np.all(p > lower) and np.all(p < upper) and np.all(model(p) > 0)):
+    raise ValueError("Start values of the Poisson fit of {} must be inside the "
+                     "bounds and give positive expectations".format(name))
+  
+  empty = bin_vals == 0
+  has_lower, has_upper = np.isfinite(lower), np.isfinite(upper)
+  count_scale = max(np.mean(bin_vals), 1.0)
+  # Barrier weights, the last one biases the likelihood negligibly
+  if np.any(empty) or np.any(has_lower) or np.any(has_upper):
+    barrier_weights = count_scale * np.logspace(-1, -10, 10)
+  else:
+    barrier_weights = [0.0]
+  
+  def objective(p, t):
+    mu = model(p)
+    if np.any(mu <= 0) or np.any(p <= lower) or np.any(p >= upper):
+      return np.inf
+    return np.sum(mu - bin_vals * np.log(mu)) - t * (
+      np.sum(np.log(mu[empty])) + np.sum(np.log((p - lower)[has_lower])) + 
+      np.sum(np.log((upper - p)[has_upper])))
+  
+  converged = True
+  for t in barrier_weights:
+    weights = bin_vals + t * empty # Barrier acts like pseudo-counts
+    value = objective(p, t)
+    for _ in range(max_iter):
+      mu = model(p)
+      J = model_jac(p)
+      dist_lower, dist_upper = p - lower, upper - p # inf for open bounds
+      grad = J.T @ (1.0 - weights / mu) - t / dist_lower + t / dist_upper
+      hess = J.T @ (J * (weights / mu**2)[:,np.newaxis]) + \
+             np.diag(t / dist_lower**2 + t / dist_upper**2)
+      step = -np.linalg.lstsq(hess, grad, rcond=None)[0]
+      decrement = -grad @ step
+      if decrement <= 1e-10 + 1e-15 * abs(value):
+        break
+      
+      # Halve the step until it stays physical and decreases the objective
+      alpha = 1.0
+      for _ in range(60):
+        new_value = objective(p + alpha * step, t)
+        if new_value <= value - 1e-4 * alpha * decrement:
+          break
+        alpha /= 2
+      else:
+        break # No further decrease possible (numerical precision)
+      p, value = p + alpha * step, new_value
+    else:
+      converged = False
+  if not converged:
+    log.warning("Poisson fit of {} did not converge in {} iterations".format(
+                name, max_iter))
+  
+  fit_y = model(p)
+  n_vanishing = np.count_nonzero(fit_y < 1e-6 * count_scale)
+  if n_vanishing > 0:
+    log.warning("Poisson fit of {} has vanishing expectations in {} bins, the "
+                "covariance is unreliable".format(name, n_vanishing))
+  J = model_jac(p)
+  cov = np.linalg.pinv(J.T @ (J / fit_y[:,np.newaxis]))
   
   return fit_y, p, cov
 
+def linear_least_squares_batch(design, bin_vals, yerr, bounds=(-np.inf,np.inf)):
+  """ Solve the weighted least squares problems of a linear model for a stack
+      of distributions at once.
+      design ... (n_bins x n_params) shared or (n_distrs x n_bins x n_params)
+      bin_vals, yerr ... (n_distrs x n_bins)
+      Returns the (n_distrs x n_params) parameters and their covariances.
+      Distributions whose unconstrained solution violates the bounds are 
+      refitted individually with linear_least_squares.
+  """
+  n_distrs, n_bins = bin_vals.shape
+  n_params = design.shape[-1]
+  lower, upper = [np.broadcast_to(np.asarray(b, dtype=float), (n_params,)) 
+                  for b in bounds]
+  design = np.broadcast_to(design, (n_distrs, n_bins, n_params))
+  A = design / yerr[:,:,np.newaxis]
+  y = bin_vals / yerr
+  
+  # Solve all normal equations at once
+  cov = np.linalg.pinv(np.einsum('nbk,nbl->nkl', A, A))
+  p = np.einsum('nkl,nl->nk', cov, np.einsum('nbk,nb->nk', A, y))
+  
+  # Unconstrained solutions inside the bounds are also the bounded solutions
+  for i in np.flatnonzero(np.any((p < lower) | (p > upper), axis=1)):
+    p[i] = linear_least_squares(design[i], bin_vals[i], yerr[i], bounds)[0]
+  
+  # Same covariance convention as curve_fit (absolute_sigma=False)
+  n_dof = n_bins - n_params
+  if n_dof > 0:
+    residuals = y - np.einsum('nbk,nk->nb', A, p)
+    cov *= (np.sum(residuals**2, axis=1) / n_dof)[:,np.newaxis,np.newaxis]
+  else:
+    cov.fill(np.inf)
+  
+  return p, cov
+
+def fit_1D_batch(func, bin_vals, edges_min, edges_max, p0=None, 
+                 bounds=(-np.inf,np.inf), method="auto", n_nodes=8, linear=None):
+  """ Fit the given function to a stack of distributions (2D array of bin 
+      values, one distribution per row).
+      The edges can either be shared (1D arrays) or given per row (2D arrays).
+      Linear models are fitted in one vectorized pass reusing the bin-integrated
+      design matrix of each distinct binning, other models are fitted one by 
+      one with fit_1D.
+      Returns the stacked fit values, parameters, covariances and chi^2/ndf.
+  """
+  bin_vals = np.atleast_2d(bin_vals)
+  n_distrs, n_bins = bin_vals.shape
+  edges_min = np.broadcast_to(edges_min, bin_vals.shape)
+  edges_max = np.broadcast_to(edges_max, bin_vals.shape)
+  yerr = np.sqrt(bin_vals) # Gaussian error
+  n_params = n_parameters(func, p0)
+  
+  # Design matrix for each distinct binning
+  binnings, i_binning = np.unique(
+    np.concatenate((edges_min, edges_max), axis=1), axis=0, return_inverse=True)
+  xs = [np.column_stack(np.split(binning, 2)) for binning in binnings]
+  
+  designs = [linear_design(func, x, n_params, method, n_nodes, linear) 
+             for x in xs]
+  
+  if all(design is not None for design in designs):
+    design = np.array(designs)[i_binning.ravel()]
+    p, cov = linear_least_squares_batch(design, bin_vals, yerr, bounds)
+    fit_y = np.einsum('nbk,nk->nb', design, p)
+  else:
+    fits = [fit_1D(func, bin_vals[i], edges_min[i], edges_max[i], p0, bounds,
+                   method, n_nodes, linear=False) for i in range(n_distrs)]
+    fit_y, p, cov = [np.array(fit_result) for fit_result in zip(*fits)]
+  
+  chisq_ndf = chi_squared(bin_vals, fit_y) / (n_bins - n_params)
+  
+  return fit_y, p, cov, chisq_ndf
+
+# ------------------------------------------------------------------------------
+
+class FitChannel:
+  """ Class describing one distribution (channel) in a simultaneous fit of 
+      several distributions with shared parameters.
+  """
+  
+  # --- Constructor ------------------------------------------------------------
+  
+  def __init__(self, name, func, bin_vals, edges_min, edges_max, parameters=None):
+    """ name ... Channel name
+        func ... Shape function of the channel, evaluated vectorized on bins
+        parameters ... Names of the global parameters passed to func (in that 
+                       order), default are the argument names of func after x
+    """
+    self.name = name
+    self.func = func
+    self.bin_vals = np.asarray(bin_vals, dtype=float)
+    self.x = np.column_stack((edges_min, edges_max)) # x ... Edges
+    if parameters is None:
+      parameters = list(inspect.signature(func).parameters)[1:]
+    self.parameters = list(parameters)
+    
+  # --- Access functions -------------------------------------------------------
+  
+  def n_bins(self):
+    """ Number of bins in this channel.
+    """
+    return len(self.bin_vals)
+
+# ------------------------------------------------------------------------------
+
+def simultaneous_parameters(channels):
+  """ Names of the global parameters of the channels (in order of appearance).
+  """
+  return list(dict.fromkeys(par for channel in channels for par in channel.parameters))
+
+def fit_simultaneous(channels, p0=None, bounds=(-np.inf,np.inf), method="auto", 
+                     n_nodes=8, linear=None, cost="chi2"):
+  """ Fit several channels (FitChannel objects) simultaneously with shared 
+      parameters. The global parameter order is given by 
+      simultaneous_parameters.
+      method, n_nodes, linear, cost ... Same as in fit_1D, applied to all 
+                                        channels
+      Returns a dict with the fit values per channel name, the global 
+      parameters and their covariance.
+  """
+  par_names = simultaneous_parameters(channels)
+  n_params = len(par_names)
+  i_pars = [[par_names.index(par) for par in channel.parameters] 
+            for channel in channels]
+  bin_vals = np.concatenate([channel.bin_vals for channel in channels])
+  slices = np.split(np.arange(len(bin_vals)), 
+                    np.cumsum([channel.n_bins() for channel in channels])[:-1])
+  
+  channel_designs = [linear_design(channel.func, channel.x, len(i_par), method, 
+                                   n_nodes, linear)
+                     for channel, i_par in zip(channels, i_pars)]
+  
+  linear_model = all(channel_design is not None 
+                     for channel_design in channel_designs)
+  if linear_model:
+    # Channel design matrices placed in the global parameter columns
+    design = np.zeros((len(bin_vals), n_params))
+    for channel_design, i_par, bins in zip(channel_designs, i_pars, slices):
+      design[np.ix_(bins, i_par)] = channel_design
+    model = lambda p: design @ p
+  else:
+    fs = [bin_integral_1D(channel.func, method, n_nodes) for channel in channels]
+    def f(_, *p):
+      p = np.asarray(p)
+      return np.concatenate([f_c(channel.x, *p[i_par]) 
+                             for f_c, channel, i_par in zip(fs, channels, i_pars)])
+    model = lambda p: f(None, *p)
+    
+    # Analytic Jacobian if all gradients known, otherwise finite differences
+    jac = None
+    if all(SSP.has_gradient(channel.func) for channel in channels):
+      jacs = [bin_integral_jac_1D(channel.func, method, n_nodes) 
+              for channel in channels]
+      def channel_jac(_, *p):
+        p = np.asarray(p)
+        J = np.zeros((len(bin_vals), n_params))
+        for jac_c, channel, i_par, bins in zip(jacs, channels, i_pars, slices):
+          J[np.ix_(bins, i_par)] = jac_c(channel.x, *p[i_par])
+        return J
+      jac = channel_jac
+    
+    if p0 is None:
+      p0 = np.ones(n_params)
+  
+  if cost == "poisson":
+    if linear_model:
+      model_jac = lambda p: design
+      p0 = feasible_start(design, bin_vals, p0, bounds)
+    elif jac is not None:
+      model_jac = lambda p: jac(None, *p)
+    else:
+      model_jac = lambda p: numerical_jacobian(model, p)
+    fit_y, p, cov = poisson_minimize(model, model_jac, bin_vals, p0, bounds, 
+                                     "simultaneous model")
+  elif cost == "chi2":
+    yerr = np.sqrt(bin_vals) # Gaussian error
+    if linear_model:
+      p, cov = linear_least_squares(design, bin_vals, yerr, bounds)
+    else:
+      p, cov = curve_fit(f=f, xdata=np.arange(len(bin_vals)), ydata=bin_vals, 
+                         sigma=yerr, p0=p0, bounds=bounds, jac=jac)
+    fit_y = model(p)
+  else:
+    raise ValueError("Unknown cost {}".format(cost))
+  
+  return {channel.name: fit_y[bins] for channel, bins in zip(channels, slices)}, p, cov
+
 # ------------------------------------------------------------------------------
 
 def chi_squared(bin_vals, fit_vals):
-  return np.sum( (bin_vals - fit_vals)**2 / bin_vals )
+  """ Chi-squared of the fit values w.r.t. the bin values (using the last 
+      axis as bins for stacked distributions).
+  """
+  return np.sum( (bin_vals - fit_vals)**2 / bin_vals, axis=-1 )
+
+# ------------------------------------------------------------------------------
+
+
+class Fit1DConfig:
+  """ Fit configuration (see fit_1D) that refits new bin values, e.g. in a 
+      bootstrap. Can be sent to worker processes if func can be pickled.
+      Calling it with bin values returns the fitted parameters.
+  """
+  
+  def __init__(self, func, edges_min, edges_max, **fit_kwargs):
+    self.func = func
+    self.edges_min = edges_min
+    self.edges_max = edges_max
+    self.fit_kwargs = fit_kwargs
+    
+  def fits_empty_bins(self):
+    """ Whether bin values with empty bins can be fitted (Poisson cost).
+    """
+    return self.fit_kwargs.get("cost", "chi2") == "poisson"
+    
+  def __call__(self, bin_vals):
+    return fit_1D(self.func, bin_vals, self.edges_min, self.edges_max, 
+                  **self.fit_kwargs)[1]
+
+class SimultaneousFitConfig:
+  """ Fit configuration (see fit_simultaneous) that refits new bin values of
+      all channels (concatenated in channel order), e.g. in a bootstrap.
+      Calling it with bin values returns the fitted global parameters.
+  """
+  
+  def __init__(self, channels, **fit_kwargs):
+    self.channels = channels
+    self.fit_kwargs = fit_kwargs
+    
+  def bin_vals(self):
+    """ Concatenated bin values of the channels.
+    """
+    return np.concatenate([channel.bin_vals for channel in self.channels])
+    
+  def fits_empty_bins(self):
+    """ Whether bin values with empty bins can be fitted (Poisson cost).
+    """
+    return self.fit_kwargs.get("cost", "chi2") == "poisson"
+    
+  def __call__(self, bin_vals):
+    bin_vals = np.split(bin_vals, np.cumsum(
+      [channel.n_bins() for channel in self.channels])[:-1])
+    channels = [FitChannel(channel.name, channel.func, channel_vals, 
+                           channel.x[:,0], channel.x[:,1], channel.parameters)
+                for channel, channel_vals in zip(self.channels, bin_vals)]
+    return fit_simultaneous(channels, **self.fit_kwargs)[1]
 
 # ------------------------------------------------------------------------------
 
+def bootstrap_chunk(fit, derived, bin_vals, n_replicas, seed, n_derived):
+  """ Fit n_replicas Poisson replicas of the bin values and evaluate the 
+      derived quantities on the parameters of each.
+      Replicas with empty bins (unless the fit uses the Poisson cost, see 
+      Fit1DConfig.fits_empty_bins) and replicas whose fit fails give NaN.
+      Returns the (n_replicas x n_derived) values, whether each replica was 
+      fitted and the number of replicas skipped for empty bins.
+  """
+  rng = np.random.default_rng(seed)
+  replicas = rng.poisson(bin_vals, size=(n_replicas,) + bin_vals.shape)
+  fits_empty = getattr(fit, "fits_empty_bins", lambda: False)()
+  values = np.full((n_replicas, n_derived), np.nan)
+  fitted = np.zeros(n_replicas, dtype=bool)
+  n_empty = 0
+  for i, replica in enumerate(replicas.astype(float)):
+    if not (fits_empty or np.all(replica > 0)):
+      n_empty += 1
+      continue
+    try:
+      values[i] = derived(fit(replica))
+    except (RuntimeError, ValueError, ArithmeticError) as error:
+      log.debug("Bootstrap replica fit failed: {}".format(error))
+      continue
+    fitted[i] = True
+  return values, fitted, n_empty
+
+def bootstrap(fit, derived, bin_vals, n_replicas=1000, seed=None, chunk_size=50, 
+              n_workers=None):
+  """ Bootstrap the distribution of derived quantities (derived(p) of the 
+      fitted parameters p, scalar or array) by refitting Poisson replicas of 
+      the bin values.
+      fit ... Fit configuration, fit(bin_vals) returns the parameters 
+              (e.g. Fit1DConfig or SimultaneousFitConfig)
+      chunk_size ... Replicas handled by one task
+      n_workers ... Processes running the chunks (default: number of CPUs,
+                    1: run in this process), fit and derived must then be 
+                    picklable (defined at the top level of a module)
+      Each chunk draws from its own stream spawned from the seed, so the 
+      result only depends on the seed and chunk_size, not on n_workers.
+      Replicas with empty bins (for chi2 fits) and replicas whose fit fails 
+      are left out of the result and counted in a warning.
+      Returns a BootstrapResult.
+  """
+  bin_vals = np.asarray(bin_vals, dtype=float)
+  nominal = np.atleast_1d(derived(fit(bin_vals)))
+  
+  chunk_sizes = [min(chunk_size, n_replicas - start) 
+                 for start in range(0, n_replicas, chunk_size)]
+  seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+  chunk_args = [(fit, derived, bin_vals, n_chunk, chunk_seed, len(nominal)) 
+                for n_chunk, chunk_seed in zip(chunk_sizes, seeds)]
+  
+  if n_workers == 1:
+    chunks = [bootstrap_chunk(*args) for args in chunk_args]
+  else:
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+      chunks = list(executor.map(bootstrap_chunk, *zip(*chunk_args)))
+  
+  values, fitted, n_empty = zip(*chunks)
+  replicas = np.concatenate(values)
+  fitted = np.concatenate(fitted)
+  n_empty = sum(n_empty)
+  n_failed = len(fitted) - np.count_nonzero(fitted) - n_empty
+  if n_empty > 0 or n_failed > 0:
+    log.warning("Skipped {} of {} bootstrap replicas: {} with empty bins, {} "
+                "with failed fits".format(n_empty + n_failed, n_replicas, 
+                                          n_empty, n_failed))
+  return BootstrapResult(nominal, replicas[fitted])
+
+class BootstrapResult:
+  """ Class holding the nominal values and the bootstrap replicas of derived
+      quantities.
+  """
+  
+  def __init__(self, nominal, replicas):
+    """ nominal ... (n_derived) values from the fit to the original bin values
+        replicas ... (n_replicas x n_derived) values from the replica fits
+    """
+    self.nominal = nominal
+    self.replicas = replicas
+    
+  def std(self):
+    """ Standard deviation of each derived quantity over the replicas.
+    """
+    return np.std(self.replicas, axis=0, ddof=1)
+    
+  def interval(self, level=0.6827):
+    """ Central percentile interval of each derived quantity, returned as 
+        lower and upper bounds.
+    """
+    tail = 50 * (1 - level)
+    return tuple(np.percentile(self.replicas, [tail, 100 - tail], axis=0))
+
+# ------------------------------------------------------------------------------
+# N-dimensional shapes
+#   N-dimensional shape functions f(x, *p) take the coordinates as x[d] for 
+#   each axis d. Their bins are hyper-rectangles, given as x array 
+#   (n_bins x 2 x n_dims) of lower (x[:,0]) and upper (x[:,1]) bin edges.
+
+def bin_edges_ND(lower, upper):
+  """ Combine the (n_bins x n_dims) lower and upper bin edges into the x array
+      of the N-dimensional bin integrals.
+  """
+  return np.stack((lower, upper), axis=1).astype(float)
+
+def gauss_legendre_grid_ND(x, n_nodes):
+  """ Tensor-product Gauss-Legendre grid with n_nodes nodes per axis in each 
+      hyper-rectangular bin of x.
+      Returns the (n_dims x n_bins x n_nodes^n_dims) nodes and the 
+      (n_bins x n_nodes^n_dims) weights.
+  """
+  n_bins, _, n_dims = x.shape
+  nodes = np.empty((n_dims, n_bins) + (n_nodes,) * n_dims)
+  weights = np.ones((n_bins,) + (n_nodes,) * n_dims)
+  for d in range(n_dims):
+    # 1D grid of the axis, broadcast along the node axes of the other axes
+    nodes_d, weights_d = gauss_legendre_grid(x[:,:,d], n_nodes)
+    shape = (n_bins,) + (1,) * d + (n_nodes,) + (1,) * (n_dims - d - 1)
+    nodes[d] = nodes_d.reshape(shape)
+    weights = weights * weights_d.reshape(shape)
+  return nodes.reshape(n_dims, n_bins, -1), weights.reshape(n_bins, -1)
+
+def bin_integral_ND(func, method="auto", n_nodes=4):
+  """ Create a function that returns the integral of the given N-dimensional
+      function in each hyper-rectangular bin.
+      method ... "auto": separable if the function is a separable combination,
+                         otherwise gauss
+                 "separable": products of the analytic 1D integrals of a
+                              ShapeProperties.separable_combination
+                 "gauss": tensor-product Gauss-Legendre quadrature with 
+                          n_nodes nodes per axis, evaluated for all bins at 
+                          once, function must accept array input
+  """
+  if method == "auto":
+    method = "separable" if hasattr(func, "separable") else "gauss"
+  if method not in ("separable", "gauss"):
+    raise ValueError("Unknown integration method {}".format(method))
+  if method == "separable" and not hasattr(func, "separable"):
+    raise ValueError("{} is not separable".format(func.__name__))
+  
+  @functools.wraps(func)
+  def wrapper_bin_integrated(x, *args):
+    """ Return the integral of the given function in each bin.
+    """
+    if method == "separable":
+      return SSP.separable_bin_matrix(func, x[:,0], x[:,1]) @ np.asarray(args)
+    nodes, weights = gauss_legendre_grid_ND(x, n_nodes)
+    return np.sum(weights * func(nodes, *args), axis=1)
+  return wrapper_bin_integrated
+
+def fit_ND(func, bin_vals, lower, upper, p0=None, bounds=(-np.inf,np.inf),
+           method="auto", n_nodes=4, linear=None, cost="chi2"):
+  """ Fit the given N-dimensional function to the provided values (which are 
+      the integral in each hyper-rectangular bin, bins flattened in any order).
+      lower, upper ... (n_bins x n_dims) lower and upper bin edges
+      method, n_nodes ... Integration method, see bin_integral_ND
+      linear, cost ... Same as in fit_1D
+      Linear models (e.g. ShapeProperties.separable_combination) only need the
+      bin integrals of their basis once, other models are fitted with finite 
+      difference gradients.
+      Returns the fit values, parameters and covariance.
+  """
+  x = bin_edges_ND(lower, upper)
+  return fit_binned(func, x, bin_vals, p0, bounds, method, n_nodes, linear, 
+                    cost, bin_integral_ND)
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,171 @@
+# ------------------------------------------------------------------------------
+
+""" Toy Monte Carlo studies of the shape fits: Poisson replicas of a
+    distribution are fitted (least squares fits in vectorized batches) to 
+    obtain the distributions of the fitted parameters, their pulls and of the
+    goodness of fit.
+"""
+
+# ------------------------------------------------------------------------------
+
+from concurrent.futures import ProcessPoolExecutor
+import logging as log
+import numpy as np
+import scipy.stats
+
+# Local modules
+import Shape.ShapeTesting as SST
+
+# ------------------------------------------------------------------------------
+# Generating and fitting toys
+
+def poisson_toys(expected, n_toys, rng):
+  """ Poisson replicas of the expected bin counts, as (n_toys x n_bins) array.
+      rng ... numpy Generator (or seed)
+  """
+  rng = np.random.default_rng(rng)
+  return rng.poisson(expected, size=(n_toys, len(expected))).astype(float)
+
+def fit_toy_chunk(func, expected, edges_min, edges_max, n_toys, seed, cost, 
+                  fit_kwargs):
+  """ Generate and fit one chunk of toys.
+      cost ... "chi2": Least squares fits, toys with empty bins are skipped as
+                       they can not be fitted with Gaussian bin errors
+               "poisson": Binned Poisson likelihood fits of all toys
+      Returns the parameters, covariances and goodness of fit per degree of
+      freedom (chi^2 or deviance) of the fitted toys, None for these if no toy
+      could be fitted, and the number of skipped toys.
+  """
+  toys = poisson_toys(expected, n_toys, seed)
+  if cost == "poisson":
+    fits = [SST.fit_1D(func, toy, edges_min, edges_max, cost="poisson", 
+                       **fit_kwargs) for toy in toys]
+    fit_y, p, cov = [np.array(fit_result) for fit_result in zip(*fits)]
+    gof_ndf = SST.likelihood_ratio_gof(toys, fit_y, p.shape[1])[0]
+    return p, cov, gof_ndf, 0
+  elif cost != "chi2":
+    raise ValueError("Unknown cost {}".format(cost))
+  
+  fittable = np.all(toys > 0, axis=1)
+  n_skipped = n_toys - np.count_nonzero(fittable)
+  if n_skipped == n_toys:
+    return None, None, None, n_skipped
+  _, p, cov, chisq_ndf = SST.fit_1D_batch(func, toys[fittable], edges_min,
+                                          edges_max, **fit_kwargs)
+  return p, cov, chisq_ndf, n_skipped
+
+def toy_study(func, expected, edges_min, edges_max, n_toys=1000, seed=None,
+              true_params=None, cost="chi2", chunk_size=10000, n_workers=1, 
+              **fit_kwargs):
+  """ Fit n_toys Poisson replicas of the expected bin counts with the function.
+      true_params ... Parameters w.r.t. which pulls are calculated, default is
+                      the fit to the expected counts themselves
+      cost ... "chi2": Vectorized least squares fits, toys with empty bins 
+                       are skipped (which biases the study at low counts)
+               "poisson": Binned Poisson likelihood fits of all toys, the 
+                          goodness of fit is the deviance
+      chunk_size ... Toys generated and fitted in one vectorized batch
+      n_workers ... Processes fitting the chunks (func must then be picklable)
+      fit_kwargs ... Passed to ShapeTesting.fit_1D_batch / fit_1D (p0, 
+                     bounds, ...)
+      The chunks use independent streams spawned from the seed, so the result
+      only depends on the seed and chunk_size, not on n_workers.
+      Returns a ToyStudy with the results.
+  """
+  expected = np.asarray(expected, dtype=float)
+  if true_params is None:
+    true_params = SST.fit_1D(func, expected, edges_min, edges_max, cost=cost,
+                             **fit_kwargs)[1]
+
+  chunk_sizes = [min(chunk_size, n_toys - start)
+                 for start in range(0, n_toys, chunk_size)]
+  seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+  chunk_args = [(func, expected, edges_min, edges_max, n_chunk, chunk_seed,
+                 cost, fit_kwargs) 
+                for n_chunk, chunk_seed in zip(chunk_sizes, seeds)]
+
+  if n_workers == 1:
+    chunks = [fit_toy_chunk(*args) for args in chunk_args]
+  else:
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+      chunks = list(executor.map(fit_toy_chunk, *zip(*chunk_args)))
+
+  n_skipped = sum(chunk[3] for chunk in chunks)
+  if n_skipped == n_toys:
+    raise ValueError("All {} toys have empty bins and can not be fitted with "
+                     "cost chi2, use cost poisson".format(n_toys))
+  if n_skipped > 0:
+    log.warning("Skipped {} of {} toys with empty bins, this biases the "
+                "study (cost poisson fits all toys)".format(n_skipped, n_toys))
+  p, cov, gof_ndf, _ = zip(*[chunk for chunk in chunks if chunk[0] is not None])
+
+  n_params = len(true_params)
+  return ToyStudy(np.concatenate(p).reshape(-1, n_params),
+                  np.concatenate(cov).reshape(-1, n_params, n_params),
+                  np.concatenate(gof_ndf), true_params, len(expected))
+
+# ------------------------------------------------------------------------------
+
+class ToyStudy:
+  """ Class holding the fit results of a set of toys.
+  """
+
+  # --- Constructor ------------------------------------------------------------
+
+  def __init__(self, params, cov, chisq_ndf, true_params, n_bins):
+    """ params ... (n_toys x n_params) fitted parameters
+        cov ... (n_toys x n_params x n_params) their covariances
+        chisq_ndf ... (n_toys) chi^2/ndf of the toy fits (deviance/ndf for 
+                      Poisson likelihood fits)
+    """
+    self.params = params
+    self.cov = cov
+    self.chisq_ndf = chisq_ndf
+    self.true_params = np.asarray(true_params)
+    self.n_bins = n_bins
+
+  # --- Access functions -------------------------------------------------------
+
+  def n_toys(self):
+    """ Number of fitted toys.
+    """
+    return len(self.params)
+
+  def errors(self):
+    """ Fitted uncertainty of each parameter in each toy.
+    """
+    return np.sqrt(np.diagonal(self.cov, axis1=1, axis2=2))
+
+  def pulls(self):
+    """ Pull of each parameter in each toy: (fitted - true) / fitted error.
+    """
+    return (self.params - self.true_params) / self.errors()
+
+  def pull_summary(self):
+    """ Mean and width of the pull distribution of each parameter with their
+        statistical uncertainties, as (n_params x 4) array:
+        mean, error of mean, width, error of width.
+        Unbiased fits with correct errors have mean 0 and width 1.
+    """
+    pulls = self.pulls()
+    n = len(pulls)
+    mean = np.mean(pulls, axis=0)
+    width = np.std(pulls, axis=0, ddof=1)
+    return np.column_stack((mean, width/np.sqrt(n), width, width/np.sqrt(2*(n-1))))
+
+  def coverage(self, levels=(0.6827, 0.9545)):
+    """ Fraction of toys in which the central interval of the given confidence
+        level (from the fitted error) contains the true parameter, as
+        (n_levels x n_params) array. Should be close to the levels.
+    """
+    abs_pulls = np.abs(self.pulls())
+    z = scipy.stats.norm.ppf(0.5 + 0.5*np.asarray(levels))
+    return np.mean(abs_pulls[np.newaxis,:,:] < z[:,np.newaxis,np.newaxis], axis=1)
+
+  def chisq_p_value(self, chisq_ndf):
+    """ Fraction of toys with a chi^2/ndf (deviance/ndf for Poisson 
+        likelihood fits) at least as large as the given one.
+    """
+    return np.mean(self.chisq_ndf >= chisq_ndf)
+
+# ------------------------------------------------------------------------------